@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the count-based Fleiss' kappa and Scott's pi against nltk's AnnotationTask.
+
+Usage, from the root of the repository so that the checkout is imported::
+
+    PYTHONPATH=. python benchmarks/bench_fleiss_scott.py --subjects 500 --coders 5 --categories 4
+"""
+
+import argparse
+import time
+import numpy as np
+from nltk.metrics.agreement import AnnotationTask
+from quica.dataset.dataset import IRRDataset
+from quica.measures.irr import FleissK, ScottsPI
+
+
+def nltk_scores(data):
+    """
+    the nltk path: one triple per annotation and pairwise Python-level work
+    """
+    task = AnnotationTask(data=[[c, s, label] for c, coder in enumerate(data) for s, label in enumerate(coder)])
+    return task.multi_kappa(), task.pi()
+
+
+def native_scores(data):
+    """
+    the count-based path, including the encoding of a fresh dataset
+    """
+    dataset = IRRDataset(data)
+    return FleissK().compute_irr(dataset), ScottsPI().compute_irr(dataset)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--subjects", type=int, default=500)
+    parser.add_argument("--coders", type=int, default=5)
+    parser.add_argument("--categories", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random = np.random.RandomState(args.seed)
+    data = random.randint(0, args.categories, size=(args.coders, args.subjects)).tolist()
+
+    nltk_result, nltk_time = timed(nltk_scores, data)
+    native_result, native_time = timed(native_scores, data)
+
+    assert np.allclose(nltk_result, native_result)
+
+    print("subjects={} coders={} categories={}".format(args.subjects, args.coders, args.categories))
+    print("fleiss={:.6f} scotts={:.6f}".format(*native_result))
+    print("nltk AnnotationTask: {:.4f} sec".format(nltk_time))
+    print("count based:         {:.4f} sec".format(native_time))
+    print("speedup:             {:.1f}x".format(nltk_time / native_time))
+
+
+if __name__ == "__main__":
+    main()
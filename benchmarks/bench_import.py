@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the import time of quica, each run in a fresh interpreter.
+Reports the median wall time of the import and of a first raw agreement on integer labels,
+the heavy dependencies loaded by them and the slowest imported packages (python -X importtime).
+
+Usage, from the root of the repository so that the checkout is imported::
+
+    PYTHONPATH=. python benchmarks/bench_import.py --module quica.quica --runs 10
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import numpy as np
+
+HEAVY = ["pandas", "scipy", "sklearn", "nltk", "krippendorff"]
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter() - start
+from quica.dataset.dataset import IRRDataset
+from quica.measures.irr import RawAgreement
+RawAgreement().compute_irr(IRRDataset([[0, 1, 1, 0], [0, 1, 0, 0]]))
+computed = time.perf_counter() - start
+print(json.dumps({{"import": imported, "raw": computed, "heavy": [name for name in {heavy} if name in sys.modules]}}))
+"""
+
+
+def run(module):
+    output = subprocess.run(
+        [sys.executable, "-c", SCRIPT.format(module=module, heavy=HEAVY)],
+        check=True, stdout=subprocess.PIPE, universal_newlines=True
+    ).stdout
+    return json.loads(output)
+
+
+def slowest_imports(module, top):
+    """
+    packages with the largest cumulative import time, from python -X importtime
+    """
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+        check=True, stderr=subprocess.PIPE, universal_newlines=True
+    ).stderr
+
+    times = []
+    for line in output.splitlines()[1:]:
+        _, _, cumulative, name = [field.strip() for field in line.replace(":", "|").split("|")]
+        if "." not in name:
+            times.append((int(cumulative), name))
+    return sorted(times, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="quica.quica")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    results = [run(args.module) for _ in range(args.runs)]
+
+    print("import {}: {:.4f} sec".format(args.module, np.median([result["import"] for result in results])))
+    print("first raw agreement: {:.4f} sec".format(np.median([result["raw"] for result in results])))
+    print("heavy dependencies loaded: {}".format(", ".join(results[0]["heavy"]) or "none"))
+    print("slowest imported packages (cumulative microseconds):")
+    for cumulative, name in slowest_imports(args.module, args.top):
+        print("    {:>10} {}".format(cumulative, name))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the vectorized MACE E-step against the original per-instance loop.
+
+Usage, from the root of the repository so that the checkout is imported::
+
+    PYTHONPATH=. python benchmarks/bench_mace_estep.py --items 2000 --annotators 15 --labels 5
+"""
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from quica.internal.measures import Mace, ALPHA, BETA, EM, ITERATIONS, RESTARTS, THRESHOLD
+from tests.reference import loop_e_step
+
+
+def best_of(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--annotators", type=int, default=15)
+    parser.add_argument("--labels", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    data = np.random.randint(0, args.labels, size=(args.items, args.annotators)).astype(str)
+
+    mace = Mace(inputfile=pd.DataFrame(data), priors={}, controls=[], alpha=ALPHA, beta=BETA,
+                em=EM, iterations=ITERATIONS, restarts=RESTARTS, threshold=THRESHOLD, smoothing=0)
+
+    loop_time = best_of(lambda: loop_e_step(mace), args.repeat)
+    vectorized_time = best_of(mace.E_step, args.repeat)
+
+    gold, _, competence_counts, likelihood = loop_e_step(mace)
+    assert np.allclose(np.exp(mace.log_gold_label_marginals), gold)
+    assert np.allclose(mace.competence_expected_counts, competence_counts)
+    assert np.isclose(mace.log_marginal_likelihood, likelihood)
+
+    print("items={} annotators={} labels={}".format(args.items, args.annotators, args.labels))
+    print("loop E-step:       {:.4f} sec".format(loop_time))
+    print("vectorized E-step: {:.4f} sec".format(vectorized_time))
+    print("speedup:           {:.1f}x".format(loop_time / vectorized_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+"""
+Scaling benchmark of the IRR measures on synthetic annotations with controlled agreement.
+Every combination of the given items, coders, categories and missing rates is generated once;
+each measure and a full Quica.get_results call are then timed on a fresh copy of the dataset,
+so that the shared statistics are computed inside the timed call, recording wall time and peak
+memory (tracemalloc, numpy allocations included). Results are saved as json and can be compared
+with the output of another version.
+
+Usage, from the root of the repository so that the checkout is imported::
+
+    PYTHONPATH=. python benchmarks/bench_scaling.py --items 100 10000 --coders 2 10 --categories 2 50 \
+        --missing 0 0.3 --output results.json
+    PYTHONPATH=. python benchmarks/bench_scaling.py --items 1000000 --cost fast --output new.json --compare results.json
+"""
+
+import argparse
+import itertools
+import json
+import platform
+import numpy as np
+import pandas as pd
+import quica
+from quica.dataset.dataset import IRRDataset
+from quica.internal.profiling import Profile
+from quica.measures.registry import select_measures
+from quica.quica import Quica
+
+CONFIGURATION = ["items", "coders", "categories", "missing"]
+
+
+def synthetic_dataset(items, coders, categories, missing, agreement, seed):
+    """
+    annotations where each coder copies a hidden true label with probability agreement
+    and otherwise picks a uniformly random one, each annotation is missing with probability missing
+    """
+    random = np.random.default_rng(seed)
+    truth = random.integers(0, categories, size=items)
+    dtype = np.int16 if categories < 2 ** 15 else np.int32
+
+    codes = np.empty((coders, items), dtype=dtype)
+    for coder in range(coders):
+        codes[coder] = np.where(random.random(items) < agreement, truth, random.integers(0, categories, size=items))
+        codes[coder][random.random(items) < missing] = -1
+
+    return codes
+
+
+def fresh(codes, categories):
+    return IRRDataset.from_codes(codes, np.arange(categories))
+
+
+def profiled(function, *args):
+    """
+    wall time and peak traced memory of a call
+    """
+    with Profile() as profile:
+        function(*args)
+    return profile.wall_time, profile.peak_memory
+
+
+def run(args):
+    records = []
+    for items, coders, categories, missing in itertools.product(args.items, args.coders, args.categories, args.missing):
+        codes = synthetic_dataset(items, coders, categories, missing, args.agreement, args.seed)
+        configuration = {"items": items, "coders": coders, "categories": categories, "missing": missing}
+        measures, names = select_measures(fresh(codes, categories), args.measures, args.cost)
+
+        for measure, name in zip(measures, names):
+            for repeat in range(args.repeats):
+                elapsed, peak = profiled(measure.compute_irr, fresh(codes, categories))
+                records.append(dict(configuration, measure=name, repeat=repeat, seconds=elapsed, peak_bytes=peak))
+
+        for repeat in range(args.repeats):
+            report = Quica(fresh(codes, categories))
+            elapsed, peak = profiled(report.get_results, None, args.measures, args.cost)
+            records.append(dict(configuration, measure="Quica.get_results", repeat=repeat, seconds=elapsed,
+                                peak_bytes=peak))
+
+        print("items={} coders={} categories={} missing={} done".format(items, coders, categories, missing))
+
+    return records
+
+
+def summarize(records):
+    """
+    best time and peak memory of each configuration and measure
+    """
+    data = pd.DataFrame(records)
+    return data.groupby(CONFIGURATION + ["measure"], sort=False).agg(
+        seconds=("seconds", "min"), peak_mb=("peak_bytes", lambda peak: peak.max() / 2 ** 20)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, nargs="+", default=[100, 10000])
+    parser.add_argument("--coders", type=int, nargs="+", default=[2, 5])
+    parser.add_argument("--categories", type=int, nargs="+", default=[2, 10])
+    parser.add_argument("--missing", type=float, nargs="+", default=[0.0])
+    parser.add_argument("--agreement", type=float, default=0.7)
+    parser.add_argument("--measures", nargs="+", default=None, help="registry keys, all the applicable ones by default")
+    parser.add_argument("--cost", default=None, help="highest cost class, e.g. fast leaves MACE out")
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="json file of the results")
+    parser.add_argument("--compare", default=None, help="json results of another version to compare with")
+    args = parser.parse_args()
+
+    records = run(args)
+    summary = summarize(records)
+    print(summary.to_string())
+
+    if args.output is not None:
+        environment = {
+            "quica": quica.__version__,
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "arguments": vars(args),
+        }
+        with open(args.output, "w") as writer:
+            json.dump({"environment": environment, "records": records}, writer, indent=1)
+
+    if args.compare is not None:
+        with open(args.compare) as reader:
+            baseline = summarize(json.load(reader)["records"])
+        comparison = summary.join(baseline, rsuffix="_baseline", how="inner")
+        comparison["speedup"] = comparison["seconds_baseline"] / comparison["seconds"]
+        comparison["memory_ratio"] = comparison["peak_mb"] / comparison["peak_mb_baseline"]
+        print(comparison[["seconds", "seconds_baseline", "speedup", "memory_ratio"]].to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,253 @@
+import sys
+import numpy as np
+from quica.internal.statistics import MISSING, category_dtype, encode, annotations_of, item_counts, \
+    coder_counts, coincidence_matrix
+
+__all__ = ["IRRDataset", "stack_tasks"]
+
+
+def is_dataframe(data):
+    # a DataFrame can only exist once pandas has been imported, so pandas is never imported here
+    pandas = sys.modules.get("pandas")
+    return pandas is not None and isinstance(data, pandas.DataFrame)
+
 
 class IRRDataset:
+    """
+    annotations of a group of coders, stored as a compact coders x subjects array of small integer codes
+    (int8 or int16 depending on the size of the codebook, -1 for missing annotations) and the codebook
+    of the labels. Sparse datasets, built with from_annotations, store (coder, subject, label) triples
+    sorted by subject instead, so their memory grows with the number of annotations.
+    The sufficient statistics used by the measures are computed once, on first use,
+    and shared by all the measures.
+
+    :param dataset: one list of labels per coder, a coders x subjects numpy array, or a pandas.DataFrame
+                    with one column per coder. None and NaN are missing annotations, shorter coders are
+                    padded with missing annotations. Integer arrays already holding the codes 0..k-1
+                    are used without copying.
+    """
+
+    __slots__ = ["_codes", "_annotations", "codebook", "coders", "subjects", "coder_names", "subject_names",
+                 "_item_counts", "_coder_counts", "_coincidence"]
+
     def __init__(self, dataset):
-        self.data = dataset
-        self.coders = len(dataset)
-        self.subjects = len(dataset[0])
+        if is_dataframe(dataset):
+            self.coder_names = list(dataset.columns)
+            dataset = dataset.values.T
+        else:
+            self.coder_names = list(range(len(dataset)))
+
+        if not isinstance(dataset, np.ndarray) and len(set(len(coder) for coder in dataset)) > 1:
+            longest = max(len(coder) for coder in dataset)
+            dataset = [list(coder) + [None] * (longest - len(coder)) for coder in dataset]
+
+        self._codes, self.codebook = encode(dataset)
+        self._annotations = None
+        self.coders, self.subjects = self._codes.shape
+        self.subject_names = None
+
+        self._item_counts = None
+        self._coder_counts = None
+        self._coincidence = None
+
+    @classmethod
+    def from_codes(cls, codes, codebook, coder_names=None, subject_names=None):
+        """
+        build a dataset from already encoded labels, without copying them
+        :param codes: coders x subjects integer codes, -1 for missing annotations
+        :param codebook: labels of the codes
+        :param coder_names: names of the coders, defaults to their index
+        :param subject_names: names of the subjects, defaults to their index
+        :return: IRRDataset
+        """
+        dataset = cls.__new__(cls)
+        dataset._codes = codes
+        dataset._annotations = None
+        dataset.codebook = np.asarray(codebook)
+        dataset.coders, dataset.subjects = codes.shape
+        dataset.coder_names = list(range(dataset.coders)) if coder_names is None else list(coder_names)
+        dataset.subject_names = subject_names
+
+        dataset._item_counts = None
+        dataset._coder_counts = None
+        dataset._coincidence = None
+        return dataset
+
+    @classmethod
+    def from_annotations(cls, coders, subjects, labels, codebook, num_coders=None, num_subjects=None,
+                         coder_names=None, subject_names=None):
+        """
+        build a sparse dataset from (coder, subject, label) triples, without a coders x subjects table.
+        Each coder is expected to annotate a subject at most once
+        :param coders: coder index of each annotation
+        :param subjects: subject index of each annotation
+        :param labels: code of the label of each annotation
+        :param codebook: labels of the codes
+        :param num_coders: number of coders, defaults to the number of coder names or the largest index + 1
+        :param num_subjects: number of subjects, defaults to the number of subject names or the largest index + 1
+        :param coder_names: names of the coders, defaults to their index
+        :param subject_names: names of the subjects, defaults to their index
+        :return: IRRDataset
+        """
+        coders, subjects, labels = np.asarray(coders), np.asarray(subjects), np.asarray(labels)
+
+        if np.any(subjects[1:] < subjects[:-1]):
+            order = np.argsort(subjects, kind="stable")
+            coders, subjects, labels = coders[order], subjects[order], labels[order]
+
+        if num_coders is None:
+            num_coders = len(coder_names) if coder_names is not None else int(coders.max(initial=-1)) + 1
+        if num_subjects is None:
+            num_subjects = len(subject_names) if subject_names is not None else int(subjects.max(initial=-1)) + 1
+
+        dataset = cls.__new__(cls)
+        dataset._codes = None
+        dataset._annotations = (coders, subjects, labels.astype(category_dtype(len(codebook)), copy=False))
+        dataset.codebook = np.asarray(codebook)
+        dataset.coders, dataset.subjects = num_coders, num_subjects
+        dataset.coder_names = list(range(num_coders)) if coder_names is None else list(coder_names)
+        dataset.subject_names = subject_names
+
+        dataset._item_counts = None
+        dataset._coder_counts = None
+        dataset._coincidence = None
+        return dataset
+
+    @property
+    def is_sparse(self):
+        return self._codes is None
+
+    @property
+    def codes(self):
+        """
+        coders x subjects integer codes of the labels, -1 for missing annotations.
+        Sparse datasets build the table on each access
+        """
+        if self._codes is not None:
+            return self._codes
+
+        coders, subjects, labels = self._annotations
+        codes = np.full((self.coders, self.subjects), MISSING, dtype=category_dtype(len(self.codebook)))
+        codes[coders, subjects] = labels
+        return codes
+
+    @property
+    def annotations(self):
+        """
+        (coder, subject, label) triples of the annotations, sorted by subject
+        """
+        if self._annotations is not None:
+            return self._annotations
+        return annotations_of(self._codes)
+
+    @property
+    def data(self):
+        """
+        decoded labels, one array per coder, None for missing annotations
+        """
+        return [self.get_coder(index) for index in range(self.coders)]
 
     def get_coder(self, index):
-        return self.data[index]
+        if self.is_sparse:
+            coders, subjects, labels = self.annotations
+            codes = np.full(self.subjects, MISSING, dtype=labels.dtype)
+            codes[subjects[coders == index]] = labels[coders == index]
+        else:
+            codes = self._codes[index]
+
+        missing = codes == MISSING
+        if not missing.any():
+            return self.codebook[codes]
+
+        labels = self.codebook.astype(object)[codes]
+        labels[missing] = None
+        return labels
+
+    def take(self, subjects):
+        """
+        dataset restricted to the given subjects, sharing the codebook
+        :param subjects: indices or boolean mask of the subjects to keep, indices can repeat
+        :return: IRRDataset
+        """
+        subject_names = None if self.subject_names is None else np.asarray(self.subject_names)[subjects]
+
+        if not self.is_sparse:
+            return IRRDataset.from_codes(self._codes[:, subjects], self.codebook, self.coder_names, subject_names)
+
+        # gather the annotation range of each selected subject, annotations are sorted by subject
+        subjects = np.arange(self.subjects)[subjects]
+        coders, annotated, labels = self.annotations
+        pointers = np.concatenate([[0], np.cumsum(np.bincount(annotated, minlength=self.subjects))])
+        lengths = pointers[subjects + 1] - pointers[subjects]
+        starts = np.repeat(pointers[subjects] - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        positions = starts + np.arange(lengths.sum())
+
+        return IRRDataset.from_annotations(
+            coders[positions], np.repeat(np.arange(len(subjects)), lengths), labels[positions], self.codebook,
+            num_coders=self.coders, num_subjects=len(subjects),
+            coder_names=self.coder_names, subject_names=subject_names
+        )
+
+    @property
+    def item_counts(self):
+        """
+        subjects x categories number of coders assigning each category to each subject
+        """
+        if self._item_counts is None:
+            self._item_counts = item_counts(self.annotations, self.subjects, len(self.codebook))
+        return self._item_counts
+
+    @property
+    def coder_counts(self):
+        """
+        coders x categories number of subjects each coder assigned to each category
+        """
+        if self._coder_counts is None:
+            self._coder_counts = coder_counts(self.annotations, self.coders, len(self.codebook))
+        return self._coder_counts
+
+    @property
+    def coincidence(self):
+        """
+        categories x categories Krippendorff's coincidence matrix
+        """
+        if self._coincidence is None:
+            self._coincidence = coincidence_matrix(self.item_counts)
+        return self._coincidence
+
+
+def stack_tasks(datasets):
+    """
+    stack datasets of the same coders along the subjects, one segment per dataset, so that the measures
+    of all of them can be computed in a single pass. The codes of each dataset are kept as they are: the
+    categories of different datasets never meet in the same segment, so the stacked codebook is just the
+    indices of the largest codebook. Measures using the label values get the codebook of each segment
+    through IRRMeasure.get_segment_statistic
+    :param datasets: list of IRRDataset with the same number of coders
+    :return: stacked IRRDataset and the segment (dataset index) of each of its subjects
+    """
+    coders = set(dataset.coders for dataset in datasets)
+    if len(coders) > 1:
+        raise Exception("Expected datasets from the same coders, got {} coders".format(sorted(coders)))
+
+    num_categories = max(len(dataset.codebook) for dataset in datasets)
+    codebook = np.arange(num_categories)
+    subjects = np.array([dataset.subjects for dataset in datasets])
+    segments = np.repeat(np.arange(len(datasets)), subjects)
+
+    if not any(dataset.is_sparse for dataset in datasets):
+        codes = np.concatenate(
+            [dataset.codes.astype(category_dtype(num_categories), copy=False) for dataset in datasets], axis=1
+        )
+        return IRRDataset.from_codes(codes, codebook, datasets[0].coder_names), segments
 
+    offsets = np.concatenate([[0], np.cumsum(subjects)[:-1]])
+    annotations = [dataset.annotations for dataset in datasets]
+    stacked = IRRDataset.from_annotations(
+        np.concatenate([coders for coders, _, _ in annotations]),
+        np.concatenate([annotated + offset for (_, annotated, _), offset in zip(annotations, offsets)]),
+        np.concatenate([labels.astype(np.int64) for _, _, labels in annotations]),
+        codebook, num_coders=datasets[0].coders, num_subjects=int(subjects.sum()),
+        coder_names=datasets[0].coder_names
+    )
+    return stacked, segments
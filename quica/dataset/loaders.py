@@ -0,0 +1,123 @@
+"""
+Loaders of long-format annotation files, with one (item, coder, label) row per annotation
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from quica.dataset.dataset import IRRDataset
+
+__all__ = ["Codebook", "iter_chunks", "read_long"]
+
+CHUNK_SIZE = 1000000
+
+
+class Codebook:
+    """
+    growing mapping from values to consecutive integer codes, in order of first appearance
+    """
+
+    def __init__(self):
+        self.mapping = {}
+        self.values = []
+
+    def encode(self, values):
+        """
+        codes of the values, new values get the next codes
+        :param values: array of values
+        :return: integer codes
+        """
+        codes, uniques = pd.factorize(values)
+        known = np.empty(len(uniques), dtype=np.int64)
+
+        for index, value in enumerate(uniques):
+            code = self.mapping.get(value)
+            if code is None:
+                code = self.mapping[value] = len(self.values)
+                self.values.append(value)
+            known[index] = code
+
+        return known[codes]
+
+
+def iter_chunks(path, columns, chunksize=CHUNK_SIZE, file_format=None, dtype=str):
+    """
+    read the given columns of a CSV or Parquet file in chunks of rows
+    :param path: path of the file
+    :param columns: columns to read
+    :param chunksize: number of rows per chunk
+    :param file_format: "csv" or "parquet", guessed from the extension when None
+    :param dtype: type of the CSV columns, or a dict from column to type. A fixed type keeps the values
+                  of all the chunks comparable, pandas would otherwise guess the type of each chunk.
+                  Parquet columns keep the type of the file schema
+    :return: generator of pandas.DataFrame
+    """
+    if file_format is None:
+        file_format = "parquet" if os.path.splitext(str(path))[1].lower() in (".parquet", ".pq") else "csv"
+
+    if file_format == "csv":
+        for chunk in pd.read_csv(path, usecols=columns, chunksize=chunksize, dtype=dtype):
+            yield chunk
+    elif file_format == "parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise Exception("Reading Parquet files requires pyarrow, install it with: pip install pyarrow")
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        raise Exception("Unknown file format {}, use csv or parquet".format(file_format))
+
+
+def read_long(path, item_column="item_id", coder_column="coder_id", label_column="label",
+              chunksize=CHUNK_SIZE, file_format=None, dtype=str):
+    """
+    stream a long-format annotation file into a sparse IRRDataset. The file is read in chunks and
+    only the integer codes of each chunk are kept, so the wide items x coders table is never built.
+    Rows with a missing label are skipped. When a coder annotates an item more than once, the last row is
+    kept, as a relabelling of the item.
+    :param path: path of a CSV or Parquet file
+    :param item_column: column with the item identifiers
+    :param coder_column: column with the coder identifiers
+    :param label_column: column with the labels
+    :param chunksize: number of rows read at once
+    :param file_format: "csv" or "parquet", guessed from the extension when None
+    :param dtype: type of the CSV columns, or a dict from column to type, strings by default so that
+                  the codes do not depend on the chunks. Numeric labels are then read as strings; the
+                  ordinal measures rank them by value, or pass e.g. {label_column: float} to keep numbers
+    :return: IRRDataset
+    """
+    items, coders, labels = Codebook(), Codebook(), Codebook()
+    item_codes, coder_codes, label_codes = [], [], []
+
+    for chunk in iter_chunks(path, [item_column, coder_column, label_column], chunksize, file_format,
+                             dtype):
+        chunk = chunk[chunk[label_column].notna()]
+        item_codes.append(items.encode(chunk[item_column].values).astype(np.int32))
+        coder_codes.append(coders.encode(chunk[coder_column].values).astype(np.int32))
+        label_codes.append(labels.encode(chunk[label_column].values).astype(np.int32))
+
+    item_codes = np.concatenate(item_codes) if item_codes else np.zeros(0, dtype=np.int32)
+    coder_codes = np.concatenate(coder_codes) if coder_codes else np.zeros(0, dtype=np.int32)
+    label_codes = np.concatenate(label_codes) if label_codes else np.zeros(0, dtype=np.int32)
+
+    # keep the last annotation of each (item, coder) pair
+    keys = item_codes.astype(np.int64) * max(len(coders.values), 1) + coder_codes
+    _, last = np.unique(keys[::-1], return_index=True)
+    if len(last) < len(keys):
+        last = np.sort(len(keys) - 1 - last)
+        item_codes, coder_codes, label_codes = item_codes[last], coder_codes[last], label_codes[last]
+
+    # sort the codebook of the labels still in use, as for the other datasets
+    used = np.zeros(len(labels.values), dtype=bool)
+    used[label_codes] = True
+    codebook = np.asarray(labels.values)[used]
+    order = np.argsort(codebook, kind="stable")
+    recode = np.full(len(used), -1, dtype=np.int32)
+    recode[np.flatnonzero(used)[order]] = np.arange(len(order))
+
+    return IRRDataset.from_annotations(
+        coder_codes, item_codes, recode[label_codes], codebook[order],
+        coder_names=coders.values, subject_names=items.values
+    )
@@ -0,0 +1,126 @@
+"""
+Content-addressed cache of measure results, keyed by a hash of the encoded dataset,
+the measure and its parameters
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from quica import __version__
+
+# default maximum number of cached results on disk
+MAX_ENTRIES = 10000
+
+# parameters choosing how a result is computed, not what it is
+EXECUTION_PARAMETERS = {"n_jobs", "backend"}
+
+
+def dataset_fingerprint(dataset):
+    """
+    hash of the encoded annotations and of the codebook of a dataset
+    :param dataset: IRRDataset
+    :return: hex digest
+    """
+    digest = hashlib.sha256()
+    digest.update(repr((dataset.coders, dataset.subjects, [str(label) for label in dataset.codebook])).encode())
+    for values in dataset.annotations:
+        digest.update(np.ascontiguousarray(values, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+def parameter_repr(value):
+    """
+    representation of a parameter, arrays are represented by a hash of their content
+    :param value: parameter value
+    :return: string
+    """
+    if isinstance(value, np.ndarray):
+        digest = hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()
+        return "array({}, {}, {})".format(value.dtype, value.shape, digest)
+    if isinstance(value, dict):
+        return "{{{}}}".format(", ".join(
+            "{}: {}".format(repr(key), parameter_repr(value[key])) for key in sorted(value, key=repr)
+        ))
+    if isinstance(value, (list, tuple)):
+        return "[{}]".format(", ".join(parameter_repr(element) for element in value))
+    return repr(value)
+
+
+def parameters_key(item):
+    """
+    key of an object from its class and parameters, e.g. a measure with its seed.
+    Callable attributes (hooks) and execution parameters (EXECUTION_PARAMETERS) do not change
+    the results and are left out
+    :param item: object whose attributes are its parameters
+    :return: string
+    """
+    parameters = sorted(
+        (name, parameter_repr(value)) for name, value in vars(item).items()
+        if name not in EXECUTION_PARAMETERS and (not callable(value) or isinstance(value, type))
+    )
+    return "{}.{}{}".format(type(item).__module__, type(item).__name__, parameters)
+
+
+class ResultCache:
+    """
+    on-disk cache of results, one small json file per result, evicting the least recently used
+    results beyond max_entries. The keys include the version of quica, so results computed by
+    another version are never served and age out of the cache
+    :param directory: directory of the cache, created when missing
+    :param max_entries: maximum number of cached results
+    """
+
+    def __init__(self, directory, max_entries=MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, *keys):
+        name = hashlib.sha256("\x00".join((__version__,) + keys).encode()).hexdigest()
+        return os.path.join(self.directory, name + ".json")
+
+    def get(self, *keys):
+        """
+        cached result, marked as recently used
+        :param keys: strings identifying the result
+        :return: the result, None when missing
+        """
+        path = self.get_path(*keys)
+        try:
+            with open(path) as reader:
+                result = json.load(reader)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return result
+
+    def set(self, value, *keys):
+        """
+        cache a result, evicting the least recently used ones when the cache is full
+        :param value: json serializable result
+        :param keys: strings identifying the result
+        """
+        path = self.get_path(*keys)
+        temporary = "{}.{}.tmp".format(path, os.getpid())
+        with open(temporary, "w") as writer:
+            json.dump(value, writer)
+        os.replace(temporary, path)
+        self.evict()
+
+    def evict(self):
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")]
+        if len(entries) <= self.max_entries:
+            return
+
+        entries.sort(key=lambda entry: entry.stat().st_mtime_ns)
+        for entry in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                os.remove(entry.path)
@@ -2,13 +2,15 @@
 From Pietro Lesci and Dirk Hovy
 """
 
-import sys
+import copy
 import time
 import numpy as np
-import pandas as pd
-from typing import Dict, List
+from typing import TYPE_CHECKING, Dict, List
 import scipy.special as ssp
-from sklearn.metrics import accuracy_score
+from quica.internal.parallel import map_jobs, get_n_jobs
+
+if TYPE_CHECKING:
+    import pandas
 
 FILLER = '__XXX__'
 MIN_ROWS = 2000
@@ -25,6 +27,33 @@ ITERATIONS = 50
 MAX_ITERATIONS = 1000
 RESTARTS = 10
 THRESHOLD = 1.0
+PRUNE_MARGIN = 0.01
+
+# model attributes carried between the training phases of a restart
+RESTART_STATE = [
+    'competence',
+    'label_preference',
+    'competence_expected_counts',
+    'label_preference_expected_counts',
+    'log_marginal_likelihood',
+]
+
+
+def restart_summary(restart, state):
+    """
+    entry of a restart in Mace.restart_trace
+    :param restart: index of the restart
+    :param state: restart state
+    :return:
+    """
+    return {
+        "restart": restart + 1,
+        "iterations": state["iterations"],
+        "log_marginal_likelihood": state["log_marginal_likelihood"],
+        "converged": state["converged"],
+        "pruned": state["pruned"],
+        "seconds": state["seconds"],
+    }
 
 
 class Mace(object):
@@ -33,7 +62,8 @@ class Mace(object):
     Parameters
     ----------
     inputfile : pandas.core.frame.DataFrame
-        Name of the input file
+        Labels with one column per annotator and FILLER for missing annotations, kept for
+        backward compatibility: from_annotations takes integer codes without going through pandas
     priors : Dict
         File name for prior likelihood of each label
     controls : List
@@ -45,18 +75,43 @@ class Mace(object):
     em : bool defalts to {EM}
         Flag to use EM training instead of VB
     iterations : int iterations > 0 defaults to {MAX_ITERATIONS / 10}
-        Number of training iterations
+        Number of training iterations, used when tolerance is None
     restarts : int restarts > 0 defaults to {RESTARTS}
         Number of random restarts
     threshold : float threshold > 0 defaults to {THRESHOLD}
         Percentage of instances (ordered by entropy) to keep
     smoothing : float smoothing > 0 defaults to 0.01/num_labels
         Smoothing parameter
+    seed : int defaults to None
+        Seed of the random restarts, None draws it from the global numpy state
+    n_jobs : int defaults to 1
+        Number of workers running the random restarts, None or -1 uses all the cores
+    backend : str defaults to "thread"
+        Pool running the random restarts, either "thread" or "process"
+    tolerance : float tolerance > 0 defaults to None
+        Stop a restart when the relative change of the log marginal likelihood
+        is below tolerance, None always runs the given iterations
+    max_iterations : int max_iterations > 0 defaults to {MAX_ITERATIONS}
+        Maximum number of training iterations when tolerance is set
+    prune_after : int prune_after > 0 defaults to None
+        Drop the restarts trailing the best one after this number of iterations, None keeps all of them
+    prune_margin : float prune_margin >= 0 defaults to {PRUNE_MARGIN}
+        Relative log marginal likelihood margin by which a restart must trail the best one to be dropped
+    deadline : float defaults to None
+        time.time() after which fit stops with a TimeoutError, checked after every iteration
+    dtype : numpy float type defaults to numpy.float64
+        Type of the per-annotation and per-instance arrays of the E-step, numpy.float32 halves their memory
+    hook : callable defaults to None
+        Called as hook(event, data) when fit starts ("mace_fit", with the settings), for every
+        iteration ("mace_iteration") and restart ("mace_restart") with their likelihood and
+        timing, and when it ends ("mace_done", with the best restart). Iterations and restarts are
+        reported as they run, from the worker threads with the thread backend; restarts run on
+        worker processes are reported when they are done
     """
 
     def __init__(
         self,
-        inputfile: pd.DataFrame,
+        inputfile: "pandas.DataFrame",
         priors: Dict,
         controls: List,
         alpha: float,
@@ -66,15 +121,19 @@ class Mace(object):
         restarts: int,
         threshold: float,
         smoothing: float,
+        seed: int = None,
+        n_jobs: int = 1,
+        backend: str = "thread",
+        tolerance: float = None,
+        max_iterations: int = MAX_ITERATIONS,
+        prune_after: int = None,
+        prune_margin: float = PRUNE_MARGIN,
+        deadline: float = None,
+        dtype=np.float64,
+        hook=None,
     ):
 
-        # read inputs
         self.inputfile = inputfile
-        self.unique_labels = np.unique(self.inputfile.values).tolist()
-        # self.unique_labels.remove(FILLER)  # remove the empty label
-        self.num_labels = len(self.unique_labels)
-        self.num_instances, self.num_annotators = self.inputfile.values.shape
-
         self.priors = priors
         self.controls = controls
         self.alpha = alpha
@@ -84,33 +143,126 @@ class Mace(object):
         self.restarts = restarts
         self.threshold = threshold
         self.smoothing = smoothing
+        self.seed = seed
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        self.prune_after = prune_after
+        self.prune_margin = prune_margin
+        self.deadline = deadline
+        self.dtype = dtype
+        self.hook = hook
+
+        # expected counts of the instances fit before, added by incremental fits
+        self.base_competence_expected_counts = None
+        self.base_label_preference_expected_counts = None
+
+        # read inputs, skipped when the annotations are given with from_annotations
+        if inputfile is not None:
+            values = np.asarray(self.inputfile.values)
+            instances, annotators = np.nonzero(values != FILLER)
+            self.set_annotations(instances, annotators, values[instances, annotators], *values.shape,
+                                 annotator_names=list(self.inputfile.columns))
+
+    def __getstate__(self):
+        # the hook is only called by the process fitting the model,
+        # so restarts can run on a process pool with any callable
+        state = dict(self.__dict__)
+        state["hook"] = None
+        return state
+
+    @classmethod
+    def from_annotations(cls, instances, annotators, labels, num_instances=None, num_annotators=None,
+                         unique_labels=None, annotator_names=None, **kwargs):
+        """
+        build the model from sparse (instance, annotator, label) triples, without a dense matrix
+        :param instances: instance index of each annotation
+        :param annotators: annotator index of each annotation
+        :param labels: label of each annotation, or its index in unique_labels when unique_labels is given
+        :param num_instances: number of instances, defaults to the largest instance index + 1
+        :param num_annotators: number of annotators, defaults to the largest annotator index + 1
+        :param unique_labels: sorted list of labels the indices in labels refer to
+        :param annotator_names: names of the annotators, matched against the state of a warm start
+        :param kwargs: the other Mace parameters
+        :return: Mace
+        """
+        model = cls(inputfile=None, **kwargs)
+        model.set_annotations(instances, annotators, labels, num_instances, num_annotators, unique_labels,
+                              annotator_names)
+        return model
+
+    def set_annotations(self, instances, annotators, labels, num_instances=None, num_annotators=None,
+                        unique_labels=None, annotator_names=None):
+        """
+        store the annotations as triples sorted by instance, with the offsets of each instance (CSR layout),
+        so that memory grows with the number of annotations
+        :return:
+        """
+        instances = np.asarray(instances)
+        annotators = np.asarray(annotators)
+
+        if unique_labels is None:
+            unique_labels, labels = np.unique(labels, return_inverse=True)
+            unique_labels = unique_labels.tolist()
+
+        labels = np.asarray(labels).reshape(-1)
+
+        if np.any(instances[1:] < instances[:-1]):
+            order = np.argsort(instances, kind="stable")
+            instances, annotators, labels = instances[order], annotators[order], labels[order]
+
+        self.unique_labels = list(unique_labels)
+        self.num_labels = len(self.unique_labels)
+        self.num_instances = int(instances.max()) + 1 if num_instances is None else num_instances
+        self.num_annotators = int(annotators.max()) + 1 if num_annotators is None else num_annotators
+        self.annotator_names = list(range(self.num_annotators)) if annotator_names is None else list(annotator_names)
+
+        self.annotation_instances = instances
+        self.annotation_annotators = annotators
+        self.annotation_labels = labels
+        self.instance_pointers = np.concatenate(
+            [[0], np.cumsum(np.bincount(instances, minlength=self.num_instances))]
+        )
 
         # set label to int dict
         self.label2int = {label: value for value, label in zip(
             range(self.num_labels), self.unique_labels)}
         self.label2int.update({FILLER: -1})
 
-
         # set int to label dict
         self.int2label = {value : label for label,
                                            value in self.label2int.items()}
-        # translate input labels to indices
-        self.labels = self.inputfile.replace(self.label2int).values.astype(int)
-
-        # for each row, get the column indices with annotations
-        self.active_annotations = [
-            [i for i in range(len(row)) if row[i] > -1]
-            for row in self.labels
-        ]
 
         # initialize all parameters
         self.reset_params()
 
-    def reset_params(self):
+    @property
+    def labels(self):
+        """
+        dense num_instances x num_annotators matrix of label indices, -1 for missing annotations.
+        It is built on demand, training and decoding work on the sparse annotations
+        :return:
+        """
+        labels = np.full((self.num_instances, self.num_annotators), -1, dtype=int)
+        labels[self.annotation_instances, self.annotation_annotators] = self.annotation_labels
+        return labels
+
+    def get_annotated_instances(self):
+        """
+        boolean mask of the instances with at least one annotation
+        :return:
+        """
+        return np.diff(self.instance_pointers) > 0
+
+    def reset_params(self, random_state=None):
         """
         set all fractrional counts and priors to 0
+        :param random_state: numpy random generator, defaults to the global numpy state
         :return:
         """
+        random_state = np.random if random_state is None else random_state
+
         # initialize fractional counts
         self.gold_label_marginals = np.zeros(
             shape=(self.num_instances, self.num_labels)
@@ -123,12 +275,12 @@ class Mace(object):
         self.competence_expected_counts = np.zeros((self.num_annotators, 2))
 
         # initialize parameters
-        self.competence = np.random.random((self.num_annotators, 2)) \
+        self.competence = random_state.random((self.num_annotators, 2)) \
                           + self.smoothing
         self.competence = self.competence / \
                           self.competence.sum(axis=1).reshape(-1, 1)
 
-        self.label_preference = np.random.random(
+        self.label_preference = random_state.random(
             (self.num_annotators, self.num_labels)
         ) + self.smoothing
         self.label_preference = self.label_preference / \
@@ -145,117 +297,77 @@ class Mace(object):
         """
         EM and Variational Bayes Expectation step, collects
         fractional counts and computes likelihood.
+
+        All quantities are computed as array operations over the
+        (annotation, label) pairs instead of per-instance loops, and the
+        products over the annotators of an instance in the log domain.
+        gold_label_marginals holds the normalized posteriors,
+        log_gold_label_marginals the unnormalized log marginals.
         """
-        # reset counts
-        self.gold_label_marginals = np.zeros(
-            shape=(self.num_instances, self.num_labels)
+        instances = self.annotation_instances
+        annotators = self.annotation_annotators
+        labels = self.annotation_labels
+        annotated = self.get_annotated_instances()
+        label_range = np.arange(self.num_labels)
+
+        # probability of each observed annotation under the spamming strategy
+        spam = (self.competence[annotators, 0] * self.label_preference[annotators, labels]).astype(self.dtype)
+        correct = self.competence[annotators, 1].astype(self.dtype)
+
+        # 1. collect instance marginals: sum over the annotations of each instance of the log factors,
+        # so that items with many annotators do not underflow
+        if self.priors:
+            priors = np.array([self.priors[l] for l in range(self.num_labels)])
+        else:
+            # uniform prior
+            priors = np.full(self.num_labels, 1.0 / self.num_labels)
+
+        with np.errstate(divide="ignore"):
+            log_priors = np.log(priors).astype(self.dtype)
+            log_factors = np.repeat(np.log(spam)[:, None], self.num_labels, axis=1)
+            log_factors[np.arange(len(labels)), labels] = np.log(spam + correct)
+
+        # look only at non-empty lines
+        self.log_gold_label_marginals = np.full((self.num_instances, self.num_labels), -np.inf, dtype=self.dtype)
+        if len(labels) > 0:
+            self.log_gold_label_marginals[annotated] = log_priors + np.add.reduceat(
+                log_factors, self.instance_pointers[:-1][annotated], axis=0
+            )
+
+        if self.controls is not None and len(self.controls) > 0:
+            controls = np.asarray(self.controls).reshape(-1, 1)
+            self.log_gold_label_marginals[controls != label_range] = -np.inf
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_instance_marginals = ssp.logsumexp(self.log_gold_label_marginals, axis=1)
+        self.log_marginal_likelihood = float(log_instance_marginals[annotated].sum(dtype=np.float64))
+
+        # gold label posteriors, the normalized marginals
+        self.gold_label_marginals = np.zeros((self.num_instances, self.num_labels), dtype=self.dtype)
+        self.gold_label_marginals[annotated] = np.exp(
+            self.log_gold_label_marginals[annotated] - log_instance_marginals[annotated, None]
         )
 
-        self.label_preference_expected_counts = np.zeros(
-            shape=(self.num_annotators, self.num_labels)
-        )
+        # 2. collect fractional counts, use the posteriors in 1.
+        # with controls, the posterior of a label differing from the control is 0,
+        # so the same formula yields the observed counts (1.0) for those annotations
+        truthful = self.gold_label_marginals[instances, labels] * correct / (spam + correct)
+        strategy = 1.0 - truthful
 
-        self.competence_expected_counts = np.zeros((self.num_annotators, 2))
+        self.label_preference_expected_counts = np.bincount(
+            annotators * self.num_labels + labels,
+            weights=strategy,
+            minlength=self.num_annotators * self.num_labels
+        ).reshape(self.num_annotators, self.num_labels)
+
+        self.competence_expected_counts = np.stack([
+            np.bincount(annotators, weights=strategy, minlength=self.num_annotators),
+            np.bincount(annotators, weights=truthful, minlength=self.num_annotators)
+        ], axis=1)
 
-        # compute marginals
-        self.log_marginal_likelihood = 0.0
-
-        for d in range(self.num_instances):
-            instance_marginal = 0.0
-
-            # look only at non-empty lines
-            if self.labels[d].sum() > -self.num_annotators:
-
-                # 1. collect instance marginals
-                # iterate over all labels
-                for l in range(self.num_labels):
-
-                    # TODO: CHECK THIS
-                    if self.priors:
-                        gold_label_marginal = self.priors[l]
-                    else:
-                        # uniform prior
-                        gold_label_marginal = 1.0 / self.num_labels
-
-                    # get only annotators who labeled
-                    for a in self.active_annotations[d]:
-                        annotation = self.labels[d][a]
-                        spam_value = self.competence[a][1] \
-                            if l == annotation else 0.0
-
-
-                        gold_label_marginal *= self.competence[a][0] * \
-                                               self.label_preference[a][annotation] + \
-                                               spam_value
-
-                    if (
-                        not self.controls
-                        or self.controls and self.controls[d] == l
-                    ):
-                        instance_marginal += gold_label_marginal
-                        self.gold_label_marginals[d][l] = gold_label_marginal
-
-                # 2. collect fractional counts, use the instance marginal in 1.
-                self.log_marginal_likelihood += np.log(instance_marginal)
-
-                for a in self.active_annotations[d]:
-                    strategy_marginal = 0.0
-
-                    annotation = self.labels[d][a]
-
-                    if self.controls:
-                        # if the annotator used the gold label
-                        if annotation == self.controls[d]:
-                            spam_value = self.competence[a][1] \
-                                if self.controls[d] == annotation else 0.0
-                            strategy_marginal += \
-                                self.gold_label_marginals[d][l] / \
-                                (self.competence[a][0] *
-                                 self.label_preference[a][annotation] +
-                                 spam_value)
-
-                            strategy_marginal *= self.competence[a][0] * \
-                                                 self.label_preference[a][annotation]
-
-                            self.label_preference_expected_counts[a][annotation] += \
-                                strategy_marginal / instance_marginal
-                            self.competence_expected_counts[a][0] += \
-                                strategy_marginal / instance_marginal
-                            self.competence_expected_counts[a][1] += (
-                                                                         self.gold_label_marginals[d][annotation] *
-                                                                         self.competence[a][1] /
-                                                                         (self.competence[a][0] *
-                                                                          self.label_preference[a][annotation] +
-                                                                          self.competence[a][1])) \
-                                                                     / instance_marginal
-
-                        # otherwise, update the observed strategy counts
-                        # and the likelihood of competence
-                        else:
-                            self.label_preference_expected_counts[a][annotation] += 1.0
-                            self.competence_expected_counts[a][0] += 1.0
-
-                    # if controls is not defined
-                    else:
-                        for l in range(self.num_labels):
-                            spam_value = \
-                                self.competence[a][1] if l == annotation else 0.0
-                            strategy_marginal += self.gold_label_marginals[d][l] / (
-                                self.competence[a][0] * self.label_preference[a][annotation] + spam_value
-                            )
-
-                        strategy_marginal *= self.competence[a][0] * \
-                                             self.label_preference[a][annotation]
-                        self.label_preference_expected_counts[a][annotation] += strategy_marginal / \
-                                                                                instance_marginal
-                        self.competence_expected_counts[a][0] += strategy_marginal / \
-                                                                 instance_marginal
-                        self.competence_expected_counts[a][1] += (self.gold_label_marginals[d][annotation] *
-                                                                  self.competence[a][1]
-                                                                  / (self.competence[a][0] * self.label_preference[a][
-                                annotation]
-                                                                     + self.competence[a][1])
-                                                                  ) / instance_marginal
+        if self.base_competence_expected_counts is not None:
+            self.competence_expected_counts += self.base_competence_expected_counts
+            self.label_preference_expected_counts += self.base_label_preference_expected_counts
 
     def M_step(self):
         """
@@ -293,144 +405,303 @@ class Mace(object):
                 self.label_preference_expected_counts.sum(axis=1).reshape(-1, 1)
             ))
 
-    def fit(self):
+    def get_state(self):
         """
-        fit selected model type on the data
-        :return:
+        fitted parameters and expected counts, with the annotators and labels they refer to,
+        to warm-start later fits
+        :return: dict of arrays
         """
-        best_restart = 0
-        best_log_marginal_likelihood = float('-inf')
-        best_competence = self.competence.copy()
-        best_label_preference = self.label_preference.copy()
+        return {
+            "annotators": np.array([str(name) for name in self.annotator_names]),
+            "labels": np.array([str(label) for label in self.unique_labels]),
+            "competence": self.competence,
+            "label_preference": self.label_preference,
+            "competence_expected_counts": self.competence_expected_counts,
+            "label_preference_expected_counts": self.label_preference_expected_counts,
+        }
+
+    def save_state(self, path):
+        """
+        save the state returned by get_state to a .npz file
+        :param path: file path
+        """
+        np.savez(path, **self.get_state())
 
-        mode = 'vanilla' if self.em else 'variational Bayes'
-        #if len(self.controls) > 0:
-            #print("Running {} EM training with CONTROLS and the following settings:".format(
-        #        mode), file=sys.stderr)
-        #else:
-            #print("Running {} EM training with the following settings:".format(
-        #        mode), file=sys.stderr)
-        #print("\t{} iterations".format(self.iterations), file=sys.stderr)
-        #print("\t{} restarts".format(self.restarts), file=sys.stderr)
-        #print("\tsmoothing = {}".format(self.smoothing), file=sys.stderr)
-        #if not self.em:
-            #print("\talpha = {}".format(self.alpha), file=sys.stderr)
-            #print("\tbeta = {}".format(self.beta), file=sys.stderr)
+    @staticmethod
+    def load_state(path):
+        """
+        load a state saved with save_state
+        :param path: file path
+        :return: dict of arrays
+        """
+        with np.load(path) as data:
+            return {key: data[key] for key in data.files}
 
-        start = time.time()
-        for restart in range(self.restarts):
-            #print("=============", file=sys.stderr)
-            #print("Restart {}".format(restart + 1), file=sys.stderr)
-            #print("=============", file=sys.stderr)
-
-            self.reset_params()
-            self.E_step()
-            #print("initial log marginal likelihood = {}".format(
-                #self.log_marginal_likelihood), file=sys.stderr)
-
-            for iter in range(self.iterations):
-                if self.em:
-                    self.M_step()
-                else:
-                    self.variational_M_step()
-
-                self.E_step()
-
-            #print("final log marginal likelihood = {}".format(
-                #self.log_marginal_likelihood), file=sys.stderr)
-
-            if self.log_marginal_likelihood > best_log_marginal_likelihood:
-                best_restart = restart + 1
-                best_log_marginal_likelihood = self.log_marginal_likelihood
-                best_competence = self.competence.copy()
-                best_label_preference = self.label_preference.copy()
-
-        #print("\nTraining completed in {} sec".format(
-        #    time.time() - start), file=sys.stderr)
-        #print("Best model came from random restart number {} (log marginal likelihood: {})".format(
-        #    best_restart, best_log_marginal_likelihood), file=sys.stderr)
-        self.log_marginal_likelihood = best_log_marginal_likelihood
-        self.competence = best_competence
-        self.label_preference = best_label_preference
+    def align_state(self, state):
+        """
+        parameters and expected counts of a state for the annotators and labels of this model,
+        matched by name. Annotators missing from the state start from the prior mean competence
+        and a uniform label preference, with no expected counts
+        :param state: dict returned by get_state or load_state
+        :return: dict of aligned arrays
+        """
+        annotator_index = {name: index for index, name in enumerate(state["annotators"])}
+        label_index = {label: index for index, label in enumerate(state["labels"])}
+        rows = np.array([annotator_index.get(str(name), -1) for name in self.annotator_names], dtype=int)
+        columns = np.array([label_index.get(str(label), -1) for label in self.unique_labels], dtype=int)
+        known, labelled = rows >= 0, columns >= 0
+
+        competence = np.tile([self.alpha, self.beta], (self.num_annotators, 1)) / (self.alpha + self.beta)
+        competence[known] = state["competence"][rows[known]]
+
+        label_preference = np.full((self.num_annotators, self.num_labels), 1.0 / self.num_labels)
+        label_preference[np.ix_(known, labelled)] = state["label_preference"][np.ix_(rows[known], columns[labelled])]
+        label_preference = label_preference / label_preference.sum(axis=1).reshape(-1, 1)
+
+        competence_counts = np.zeros((self.num_annotators, 2))
+        competence_counts[known] = state["competence_expected_counts"][rows[known]]
+        label_preference_counts = np.zeros((self.num_annotators, self.num_labels))
+        label_preference_counts[np.ix_(known, labelled)] = \
+            state["label_preference_expected_counts"][np.ix_(rows[known], columns[labelled])]
+
+        return {
+            "competence": competence,
+            "label_preference": label_preference,
+            "competence_expected_counts": competence_counts,
+            "label_preference_expected_counts": label_preference_counts,
+        }
+
+    def get_warm_state(self, state):
+        """
+        restart state starting from the parameters of a previous fit
+        :param state: dict returned by get_state or load_state
+        :return: restart state
+        """
+        aligned = self.align_state(state)
+        model = copy.copy(self)
+        model.competence = aligned["competence"]
+        model.label_preference = aligned["label_preference"]
+        model.E_step()
+
+        warm_state = {"iterations": 0, "converged": False, "pruned": False, "seconds": 0.0, "trace": [
+            {"iteration": 0, "log_marginal_likelihood": model.log_marginal_likelihood, "seconds": 0.0}
+        ]}
+        warm_state.update({key: getattr(model, key) for key in RESTART_STATE})
+        return warm_state
+
+    def get_random_states(self):
+        """
+        spawn one independent random generator per restart from the seed,
+        when no seed is given the entropy is drawn from the global numpy state
+        :return:
+        """
+        seed = self.seed if self.seed is not None else np.random.randint(2 ** 31)
+        return [np.random.default_rng(child) for child in np.random.SeedSequence(seed).spawn(self.restarts)]
 
-        # run E-Step to produce marginal likelihood of best model
-        self.E_step()
+    def _report_restart(self, restart, state, start=0):
+        """
+        send the iterations of a restart from the given one and, when the restart is done, its summary to the hook
+        """
+        for iteration in state["trace"][start:]:
+            self.hook("mace_iteration", dict(iteration, restart=restart + 1))
+        if state["done"]:
+            self.hook("mace_restart", restart_summary(restart, state))
 
-        self.aggregate_labels = self.decode()
+    def _restart(self, job):
+        """
+        train a copy of the model, starting from a random initialization or from
+        the state returned by a previous call
+        :param job: tuple with the restart index, a random generator or a restart state, the maximum number of
+                    iterations, whether the restart is done after them and whether to report it to the hook live
+        :return: state of the trained copy
+        """
+        restart, start, iterations, final, live = job
+        model = copy.copy(self)
 
-    def decode(self):
+        if isinstance(start, dict):
+            state = dict(start)
+            for key in RESTART_STATE:
+                setattr(model, key, state[key])
+        else:
+            model.reset_params(start)
+            model.E_step()
+            state = {"iterations": 0, "converged": False, "pruned": False, "seconds": 0.0, "trace": [
+                {"iteration": 0, "log_marginal_likelihood": model.log_marginal_likelihood, "seconds": 0.0}
+            ]}
+
+        state["done"] = False
+        if live and state["iterations"] == 0:
+            self._report_restart(restart, state)
+
+        for iter in range(iterations):
+            previous_log_marginal_likelihood = model.log_marginal_likelihood
+            start_time = time.perf_counter()
+
+            if model.em:
+                model.M_step()
+            else:
+                model.variational_M_step()
+
+            model.E_step()
+            state["iterations"] += 1
+            seconds = time.perf_counter() - start_time
+            state["seconds"] += seconds
+            state["trace"].append({
+                "iteration": state["iterations"],
+                "log_marginal_likelihood": model.log_marginal_likelihood,
+                "seconds": seconds,
+            })
+            if live:
+                self._report_restart(restart, state, len(state["trace"]) - 1)
+
+            if self.deadline is not None and time.time() > self.deadline:
+                raise TimeoutError("MACE did not converge before its deadline")
+
+            if self.tolerance is not None and abs(model.log_marginal_likelihood - previous_log_marginal_likelihood) \
+                    <= self.tolerance * abs(previous_log_marginal_likelihood):
+                state["converged"] = True
+                break
+
+        state.update({key: getattr(model, key) for key in RESTART_STATE})
+
+        state["done"] = final or state["converged"]
+        if live and state["done"]:
+            self.hook("mace_restart", restart_summary(restart, state))
+        return state
+
+    def _run_restarts(self, states, iterations, final=True):
+        """
+        train the restarts that are neither converged nor pruned, for at most iterations in total.
+        Restarts trained in this process or on threads report to the hook as they run, the others when they return
+        :param states: random generators or restart states
+        :param iterations: total number of iterations of each restart
+        :param final: whether the restarts are done after these iterations
+        :return: updated restart states
         """
-        get most likely label for each instance
+        running = [
+            restart for restart, state in enumerate(states)
+            if not isinstance(state, dict) or not (state["converged"] or state["pruned"])
+        ]
+        live = self.hook is not None and (self.backend == "thread" or min(get_n_jobs(self.n_jobs), len(running)) <= 1)
+        jobs = [
+            (restart, states[restart],
+             iterations - (states[restart]["iterations"] if isinstance(states[restart], dict) else 0), final, live)
+            for restart in running
+        ]
+        reported = {
+            restart: len(states[restart]["trace"]) if isinstance(states[restart], dict) and
+            states[restart]["iterations"] > 0 else 0
+            for restart in running
+        }
+
+        states = list(states)
+        for restart, state in zip(running, map_jobs(self._restart, jobs, n_jobs=self.n_jobs, backend=self.backend)):
+            states[restart] = state
+            if self.hook is not None and not live:
+                self._report_restart(restart, state, reported[restart])
+        return states
+
+    def fit(self, initial_state=None, incremental=False):
+        """
+        fit selected model type on the data, random restarts are independent
+        and run on n_jobs workers, each with its own random generator stream.
+        With a tolerance, each restart stops when the relative change of the log marginal
+        likelihood falls below it, or after max_iterations; with prune_after, restarts
+        trailing the best one by more than prune_margin after prune_after iterations are dropped.
+        The iterations and final likelihood of each restart are stored in restart_trace.
+        With an initial_state (see get_state) a single restart starts from its parameters, matching
+        annotators and labels by name; incremental fits treat the annotations as new instances,
+        adding the expected counts of the state to the counts of the new instances at every M-step.
+        :param initial_state: state of a previous fit to warm-start from, None starts from random restarts
+        :param incremental: keep the expected counts of the instances of initial_state
         :return:
         """
-        entropies = self.get_label_entropies()
-        entropy_threshold = self.get_entropy_for_threshold()
-        result = []
+        mode = 'vanilla' if self.em else 'variational Bayes'
+        if self.hook is not None:
+            settings = {
+                "mode": mode,
+                "controls": self.controls is not None and len(self.controls) > 0,
+                "iterations": self.iterations if self.tolerance is None else self.max_iterations,
+                "restarts": self.restarts if initial_state is None else 1,
+                "smoothing": self.smoothing,
+            }
+            if not self.em:
+                settings.update({"alpha": self.alpha, "beta": self.beta})
+            self.hook("mace_fit", settings)
 
-        for d in range(self.num_instances):
-            best_prob = float('-inf')
-            best_label = -1
+        start = time.time()
+        iterations = self.iterations if self.tolerance is None else self.max_iterations
+
+        self.base_competence_expected_counts = None
+        self.base_label_preference_expected_counts = None
+        if initial_state is not None and incremental:
+            aligned = self.align_state(initial_state)
+            self.base_competence_expected_counts = aligned["competence_expected_counts"]
+            self.base_label_preference_expected_counts = aligned["label_preference_expected_counts"]
+
+        states = self.get_random_states() if initial_state is None else [self.get_warm_state(initial_state)]
+
+        if initial_state is None and self.prune_after is not None and self.prune_after < iterations:
+            states = self._run_restarts(states, self.prune_after, final=False)
+            best_log_marginal_likelihood = max(state["log_marginal_likelihood"] for state in states)
+            for restart, state in enumerate(states):
+                state["pruned"] = not state["converged"] and state["log_marginal_likelihood"] < \
+                    best_log_marginal_likelihood - self.prune_margin * abs(best_log_marginal_likelihood)
+                if state["pruned"]:
+                    state["done"] = True
+                    if self.hook is not None:
+                        self.hook("mace_restart", restart_summary(restart, state))
+
+        states = self._run_restarts(states, iterations)
+
+        self.restart_trace = [restart_summary(restart, state) for restart, state in enumerate(states)]
+
+        # ties are broken by the restart order, so the best model
+        # does not depend on the number of workers
+        best_restart = 0
+        for restart, state in enumerate(states):
+            if state["log_marginal_likelihood"] > states[best_restart]["log_marginal_likelihood"]:
+                best_restart = restart
 
-            if entropies[d] <= entropy_threshold:
+        best_log_marginal_likelihood = states[best_restart]["log_marginal_likelihood"]
 
-                if entropies[d] == float('-inf'):
-                    result.append('')
-                else:
-                    for l in range(self.num_labels):
-                        if self.gold_label_marginals[d][l] > best_prob:
-                            best_prob = self.gold_label_marginals[d][l]
-                            best_label = l
-                    result.append(self.int2label[best_label])
+        if self.hook is not None:
+            self.hook("mace_done", {
+                "best_restart": best_restart + 1,
+                "log_marginal_likelihood": best_log_marginal_likelihood,
+                "seconds": time.time() - start,
+            })
 
-            else:
-                result.append('')
+        self.log_marginal_likelihood = best_log_marginal_likelihood
+        self.competence = states[best_restart]["competence"]
+        self.label_preference = states[best_restart]["label_preference"]
 
-        return result
+        # run E-Step to produce marginal likelihood of best model
+        self.E_step()
 
-    def decode_distribution(self):
+        self.aggregate_labels = self.decode()
+
+    def get_posteriors(self):
         """
-        get distribution over labels for each instance
-        :return:
+        posterior distribution over the labels of each instance, rows of zeros for unannotated instances
+        :return: num_instances x num_labels array, columns ordered as unique_labels
         """
-        result = []
+        return self.gold_label_marginals
 
-        for d in range(self.num_instances):
-            if self.labels[d].sum() == -self.num_annotators:
-                result.append('')
-            else:
-                probs = self.gold_label_marginals[d] / \
-                        self.gold_label_marginals[d].sum()
-                order = np.argsort(probs)[::-1]
-                result.append(
-                    list(zip([self.int2label[label] for label in order], probs[order])))
-
-        return result
-
-    def get_label_entropies(self):
+    def get_label_entropies(self, posteriors=None):
         """
-        compute entropy of each instance
-        :return:
-        #TODO: test!
+        compute entropy of each instance, -inf for unannotated instances
+        :param posteriors: posteriors of the instances, computed when not given
+        :return: array of entropies
         """
-        result = []
-
-        for d in range(self.num_instances):
-            if self.labels[d].sum() == -self.num_annotators:
-                result.append(float('-inf'))
-            else:
-                probs = self.gold_label_marginals[d] / \
-                        self.gold_label_marginals[d].sum()
-                entropy = np.where(probs > 0.0, -probs *
-                                   np.log(probs), 0.0).sum()
-                result.append(entropy)
-
-        return result
+        posteriors = self.get_posteriors() if posteriors is None else posteriors
+        return np.where(self.get_annotated_instances(), ssp.entr(posteriors).sum(axis=1), -np.inf)
 
-    def get_entropy_for_threshold(self):
+    def get_entropy_for_threshold(self, entropies=None):
         """
         decide entropy-value cutoff for given threshold
+        :param entropies: entropies of the instances, computed when not given
         :return:
-        TODO: DEPRRECATED?
         """
         if self.threshold == 0.0:
             pivot = 0
@@ -439,8 +710,57 @@ class Mace(object):
         else:
             pivot = int(self.num_instances * self.threshold)
 
-        entropies = self.get_label_entropies()
-        return np.sort(entropies)[pivot]
+        entropies = self.get_label_entropies() if entropies is None else entropies
+        return np.partition(entropies, pivot)[pivot]
+
+    def decode_arrays(self):
+        """
+        most likely label of each instance, computing the posteriors, entropies and threshold once
+        :return: label indices (-1 for instances that are unannotated or above the entropy threshold),
+                 num_instances x num_labels posteriors and entropies
+        """
+        posteriors = self.get_posteriors()
+        entropies = self.get_label_entropies(posteriors)
+        decoded = (entropies <= self.get_entropy_for_threshold(entropies)) & (entropies != -np.inf)
+        labels = np.where(decoded, posteriors.argmax(axis=1), -1)
+        return labels, posteriors, entropies
+
+    def decode(self):
+        """
+        get most likely label for each instance, '' when it is not decoded
+        :return:
+        """
+        labels, _, _ = self.decode_arrays()
+        return np.array(self.unique_labels + [''], dtype=object)[labels].tolist()
+
+    def decode_distribution(self):
+        """
+        get distribution over labels for each instance, sorted by decreasing probability
+        :return:
+        """
+        posteriors = self.get_posteriors()
+        order = np.argsort(posteriors, axis=1)[:, ::-1]
+        probabilities = np.take_along_axis(posteriors, order, axis=1)
+        names = np.array(self.unique_labels, dtype=object)[order]
+
+        return [
+            list(zip(names[d], probabilities[d])) if annotated else ''
+            for d, annotated in enumerate(self.get_annotated_instances())
+        ]
+
+    def get_decoded_table(self):
+        """
+        decoded label, entropy and posterior of each label for every instance, as a pandas.DataFrame
+        with one row per instance, ready for DataFrame.to_parquet or pyarrow.Table.from_pandas
+        :return:
+        """
+        import pandas as pd
+
+        labels, posteriors, entropies = self.decode_arrays()
+        table = pd.DataFrame(posteriors, columns=["posterior_{}".format(label) for label in self.unique_labels])
+        table.insert(0, "label", pd.Categorical.from_codes(labels, categories=self.unique_labels))
+        table.insert(1, "entropy", entropies)
+        return table
 
     def get_test(self):
         """
@@ -449,11 +769,12 @@ class Mace(object):
         """
         with open(self.test) as test_file:
             gold = [line.strip() for line in test_file.readlines()]
-        #print(gold, self.labels, self.aggregate_labels)
-        assert len(
-            gold) == self.num_instances, 'Gold labels and input file have different number of instances ({} vs {})'.format(
-            len(gold), self.num_instances)
-        #print(accuracy_score(gold, self.aggregate_labels))
+        assert len(gold) == self.num_instances, \
+            'Gold labels and input file have different number of instances ({} vs {})'.format(
+                len(gold), self.num_instances)
+        from sklearn.metrics import accuracy_score
+
+        return accuracy_score(gold, self.aggregate_labels)
 
 """
 coder_1 = ["0", "1", "0", "1", "0", "1", "0"]
@@ -0,0 +1,44 @@
+"""
+Helpers to spread independent jobs over a thread or process pool
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+BACKENDS = {
+    "thread": ThreadPoolExecutor,
+    "process": ProcessPoolExecutor,
+}
+
+
+def get_n_jobs(n_jobs):
+    """
+    resolve the number of workers, None or a negative value means all the cores
+    :param n_jobs: requested number of workers
+    :return:
+    """
+    if n_jobs is None or n_jobs < 0:
+        return os.cpu_count() or 1
+    return max(1, n_jobs)
+
+
+def map_jobs(function, iterable, n_jobs=1, backend="thread"):
+    """
+    apply function to every element of iterable, keeping the input order
+    :param function: callable to apply, must be picklable with the process backend
+    :param iterable: job arguments
+    :param n_jobs: number of workers, 1 runs the jobs sequentially in the current process
+    :param backend: "thread" or "process"
+    :return: list of results
+    """
+    if backend not in BACKENDS:
+        raise Exception("Unknown backend {}, use one of {}".format(backend, list(BACKENDS)))
+
+    jobs = list(iterable)
+    n_jobs = min(get_n_jobs(n_jobs), len(jobs))
+
+    if n_jobs <= 1:
+        return [function(job) for job in jobs]
+
+    with BACKENDS[backend](max_workers=n_jobs) as executor:
+        return list(executor.map(function, jobs))
@@ -0,0 +1,50 @@
+"""
+Wall time, CPU time and memory instrumentation reported to the hooks.
+A hook is a callable receiving the name of an event and a dict with its data
+"""
+
+import time
+import tracemalloc
+
+
+class Profile:
+    """
+    context manager recording the wall time, the CPU time of the process and the peak memory
+    allocated by the block (tracemalloc, numpy arrays included), in seconds and bytes.
+    Tracing the allocations slows down the block, a disabled profile records nothing
+    :param enabled: whether to record the block
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+
+    def __enter__(self):
+        if not self.enabled:
+            return self
+
+        self.tracing = tracemalloc.is_tracing()
+        if not self.tracing:
+            tracemalloc.start()
+        elif hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        self.start_memory, _ = tracemalloc.get_traced_memory()
+
+        self.start_wall_time = time.perf_counter()
+        self.start_cpu_time = time.process_time()
+        return self
+
+    def __exit__(self, *exception):
+        if not self.enabled:
+            return False
+
+        self.wall_time = time.perf_counter() - self.start_wall_time
+        self.cpu_time = time.process_time() - self.start_cpu_time
+
+        _, peak = tracemalloc.get_traced_memory()
+        self.peak_memory = max(peak - self.start_memory, 0)
+        if not self.tracing:
+            tracemalloc.stop()
+        return False
+
+    def as_dict(self):
+        return {"wall_time": self.wall_time, "cpu_time": self.cpu_time, "peak_memory": self.peak_memory}
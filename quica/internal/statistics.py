@@ -0,0 +1,507 @@
+"""
+Sufficient statistics shared by the agreement measures and the formulas computing
+the measures from them. All the statistics are computed from the integer encoding of
+the annotations, either a coders x subjects array where -1 marks a missing annotation
+or the equivalent sparse (coder, subject, label) triples.
+"""
+
+import numpy as np
+
+MISSING = -1
+
+LEVELS = ["nominal", "ordinal", "interval", "ratio"]
+
+
+def category_dtype(num_categories):
+    """
+    smallest signed integer type holding the codes of num_categories categories and the missing code
+    :param num_categories: size of the codebook
+    :return: numpy dtype
+    """
+    for dtype in (np.int8, np.int16, np.int32):
+        if num_categories <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def encode(data):
+    """
+    encode the labels of a coders x subjects table as small integers, None and NaN are missing annotations.
+    Integer arrays whose labels are already 0..k-1 are used as codes without copying when their type fits
+    :param data: coders x subjects labels
+    :return: integer codes, -1 for missing annotations, and the sorted codebook of the labels
+    """
+    values = np.asarray(data)
+
+    # codes 0..k-1 all fit below the number of annotations, larger labels (ids, timestamps) are factorized
+    if values.dtype.kind in "iu" and values.size > 0 and values.min() >= 0 and values.max() < values.size:
+        present = np.zeros(int(values.max()) + 1, dtype=bool)
+        for row in values:
+            present[row] = True
+        if present.all():
+            return values.astype(category_dtype(len(present)), copy=False), np.arange(len(present))
+
+    import pandas as pd
+
+    if values.dtype.kind not in "iub":
+        values = np.asarray(data, dtype=object)
+
+    missing = pd.isnull(values)
+    labels, codebook = pd.factorize(values[~missing], sort=True)
+    codes = np.full(values.shape, MISSING, dtype=category_dtype(len(codebook)))
+    codes[~missing] = labels
+
+    return codes, np.asarray(codebook)
+
+
+def annotations_of(codes):
+    """
+    sparse (coder, subject, label) triples of the annotations of a dense table of codes, sorted by subject
+    :param codes: coders x subjects integer codes
+    :return: tuple of the coder, subject and label code of each annotation
+    """
+    subjects, coders = np.nonzero(codes.T != MISSING)
+    return coders, subjects, codes[coders, subjects]
+
+
+def item_counts(annotations, num_subjects, num_categories):
+    """
+    number of coders assigning each category to each subject
+    :param annotations: (coder, subject, label) triples
+    :param num_subjects: number of subjects
+    :param num_categories: size of the codebook
+    :return: subjects x categories counts
+    """
+    _, subjects, labels = annotations
+    return np.bincount(
+        subjects.astype(np.int64) * num_categories + labels,
+        minlength=num_subjects * num_categories
+    ).reshape(num_subjects, num_categories)
+
+
+def coder_counts(annotations, num_coders, num_categories):
+    """
+    number of subjects each coder assigned to each category
+    :param annotations: (coder, subject, label) triples
+    :param num_coders: number of coders
+    :param num_categories: size of the codebook
+    :return: coders x categories counts
+    """
+    coders, _, labels = annotations
+    return np.bincount(
+        coders.astype(np.int64) * num_categories + labels,
+        minlength=num_coders * num_categories
+    ).reshape(num_coders, num_categories)
+
+
+def coincidence_matrix(counts):
+    """
+    Krippendorff's coincidence matrix, subjects with less than two annotations are not pairable
+    :param counts: subjects x categories counts, optionally with leading batch dimensions
+    :return: categories x categories coincidences
+    """
+    annotations = counts.sum(axis=-1, keepdims=True)
+    weights = np.where(annotations > 1, 1.0 / np.maximum(annotations - 1, 1), 0.0)
+    weighted = counts * weights
+
+    coincidence = np.matmul(np.swapaxes(weighted, -1, -2), counts)
+    diagonal = weighted.sum(axis=-2)
+    coincidence[..., np.arange(counts.shape[-1]), np.arange(counts.shape[-1])] -= diagonal
+    return coincidence
+
+
+def nominal_alpha(diagonal, marginals):
+    """
+    nominal Krippendorff's alpha from the trace and the marginals of the coincidence matrix
+    :param diagonal: sum of the diagonal of the coincidence matrix
+    :param marginals: marginals of the coincidence matrix
+    :return:
+    """
+    total = marginals.sum(axis=-1)
+
+    observed = total - diagonal
+    expected = (total ** 2 - (marginals ** 2).sum(axis=-1)) / (total - 1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return 1.0 - observed / expected
+
+
+def nominal_sums(counts):
+    """
+    trace and marginals of the coincidence matrix, without building it
+    :param counts: subjects x categories counts
+    :return: per-subject contribution to the trace and subjects x categories contributions to the marginals
+    """
+    annotations = counts.sum(axis=-1)
+    weights = np.where(annotations > 1, 1.0 / np.maximum(annotations - 1, 1), 0.0)
+    return agreeing_pairs(counts) * weights, counts * (annotations > 1)[..., None]
+
+
+def krippendorff_alpha(coincidence):
+    """
+    nominal Krippendorff's alpha
+    :param coincidence: categories x categories coincidences, optionally with leading batch dimensions
+    :return:
+    """
+    return nominal_alpha(np.trace(coincidence, axis1=-2, axis2=-1), coincidence.sum(axis=-1))
+
+
+def category_ranks(codebook, order=None):
+    """
+    rank of each category of a codebook on an ordinal scale. Labels that convert to numbers, e.g. the
+    strings "1" to "10" read from a file, are ranked by their value, the others by their codebook position
+    :param codebook: labels of the categories
+    :param order: labels from the lowest to the highest, overrides the ranking of the codebook
+    :return: permutation of 0..categories-1
+    """
+    if order is not None:
+        position = {label: index for index, label in enumerate(order)}
+        unknown = [label for label in codebook if label not in position]
+        if unknown:
+            raise Exception("Labels {} are missing from the order of the categories".format(unknown))
+        keys = np.array([position[label] for label in codebook])
+    else:
+        try:
+            keys = np.asarray(codebook, dtype=float)
+        except (TypeError, ValueError):
+            keys = np.arange(len(codebook))
+    return np.argsort(np.argsort(keys, kind="stable"), kind="stable")
+
+
+def distance_matrix(level, values=None, marginals=None, ranks=None):
+    """
+    squared distances between the categories used by Krippendorff's alpha
+    :param level: level of measurement, one of LEVELS
+    :param values: numeric value of each category, optionally with leading batch dimensions,
+                   needed by the interval and ratio levels
+    :param marginals: marginals of the coincidence matrix, optionally with leading batch dimensions,
+                      needed by the ordinal level where the distance depends on the categories in between
+    :param ranks: rank of each category (category_ranks) for the ordinal level, the codebook order by default
+    :return: categories x categories distances, with the leading dimensions of the values or the marginals
+    """
+    if level == "nominal":
+        num_categories = np.shape(values)[-1] if values is not None else marginals.shape[-1]
+        return 1.0 - np.eye(num_categories)
+
+    if level == "ordinal":
+        # number of values ranked between each pair of categories, counting half of the two categories
+        positions = np.arange(marginals.shape[-1])
+        ranks = positions if ranks is None else ranks
+        ranked = np.zeros_like(marginals, dtype=float)
+        ranked[..., ranks] = marginals
+        cumulative = np.cumsum(ranked, axis=-1)
+        lower, upper = np.minimum.outer(positions, positions), np.maximum.outer(positions, positions)
+        between = cumulative[..., upper] - cumulative[..., lower] + ranked[..., lower]
+        distance = (between - (ranked[..., :, None] + ranked[..., None, :]) / 2.0) ** 2
+        return distance[..., ranks[:, None], ranks[None, :]]
+
+    values = np.asarray(values, dtype=float)
+    difference = values[..., :, None] - values[..., None, :]
+
+    if level == "interval":
+        return difference ** 2
+
+    if level == "ratio":
+        total = values[..., :, None] + values[..., None, :]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(total != 0, difference / total, 0.0) ** 2
+
+    raise Exception("Unknown level of measurement {}, use one of {}".format(level, LEVELS))
+
+
+def weighted_alpha(coincidence, distance):
+    """
+    Krippendorff's alpha with the given distances between the categories
+    :param coincidence: categories x categories coincidences, optionally with leading batch dimensions
+    :param distance: categories x categories distances, optionally with the same leading dimensions
+    :return:
+    """
+    marginals = coincidence.sum(axis=-1)
+    total = marginals.sum(axis=-1)
+
+    observed = (coincidence * distance).sum(axis=(-2, -1))
+    expected = (marginals[..., :, None] * marginals[..., None, :] * distance).sum(axis=(-2, -1)) / (total - 1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return 1.0 - observed / expected
+
+
+def subject_coincidences(counts):
+    """
+    contribution of each subject to the coincidence matrix, subjects with less than two annotations are not pairable
+    :param counts: subjects x categories counts
+    :return: sparse subjects x (categories * categories) matrix, summing to the coincidence matrix
+    """
+    import scipy.sparse as sps
+
+    num_subjects, num_categories = counts.shape
+    annotations = counts.sum(axis=1)
+    rows, columns = np.nonzero(counts * (annotations > 1)[:, None])
+    values = counts[rows, columns]
+
+    # every pair of categories present in the same subject
+    lengths = np.bincount(rows, minlength=num_subjects)[rows]
+    first = np.repeat(np.arange(len(rows)), lengths)
+    starts = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=num_subjects))[:-1]])[rows]
+    offsets = np.arange(len(first)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    second = starts[first] + offsets
+
+    products = values[first] * (values[second] - (columns[first] == columns[second]))
+    return sps.csr_matrix(
+        (products / (annotations[rows[first]] - 1), (rows[first], columns[first] * num_categories + columns[second])),
+        shape=(num_subjects, num_categories ** 2)
+    )
+
+
+def paired_cells(first, second, num_categories):
+    """
+    cell of the confusion matrix of two coders for each subject
+    :param first: integer codes of the first coder
+    :param second: integer codes of the second coder
+    :param num_categories: size of the codebook
+    :return: first * num_categories + second, -1 when a coder did not annotate the subject
+    """
+    first = np.asarray(first, dtype=np.int64)
+    second = np.asarray(second, dtype=np.int64)
+    return np.where((first != MISSING) & (second != MISSING), first * num_categories + second, MISSING)
+
+
+def confusion_matrix(first, second, num_categories):
+    """
+    categories x categories counts of the labels of two coders, on the subjects both annotated
+    :param first: integer codes of the first coder
+    :param second: integer codes of the second coder
+    :param num_categories: size of the codebook
+    :return:
+    """
+    cells = paired_cells(first, second, num_categories)
+    return np.bincount(cells[cells != MISSING], minlength=num_categories ** 2).reshape(num_categories, num_categories)
+
+
+def kappa_weights(num_categories, weights=None, ranks=None):
+    """
+    disagreement weights of Cohen's kappa, from the rank of the categories
+    :param num_categories: size of the codebook
+    :param weights: None for unweighted kappa, "linear" or "quadratic"
+    :param ranks: rank of each category (category_ranks), the codebook order by default
+    :return: categories x categories weights
+    """
+    ranks = np.arange(num_categories) if ranks is None else np.asarray(ranks)
+    if weights is None:
+        return 1.0 - np.eye(num_categories)
+    if weights == "linear":
+        return np.abs(ranks[:, None] - ranks[None, :]).astype(float)
+    if weights == "quadratic":
+        return (ranks[:, None] - ranks[None, :]).astype(float) ** 2
+    raise Exception("Unknown kappa weights {}, use None, linear or quadratic".format(weights))
+
+
+def cohens_kappa(confusion, weights=None):
+    """
+    Cohen's kappa of two coders
+    :param confusion: categories x categories counts of the labels of the first and second coder,
+                      optionally with leading batch dimensions
+    :param weights: categories x categories disagreement weights, None for unweighted kappa
+    :return:
+    """
+    disagreement = kappa_weights(confusion.shape[-1]) if weights is None else weights
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        observed = confusion / confusion.sum(axis=(-2, -1), keepdims=True)
+        expected = observed.sum(axis=-1)[..., :, None] * observed.sum(axis=-2)[..., None, :]
+
+        return 1.0 - (disagreement * observed).sum(axis=(-2, -1)) / (disagreement * expected).sum(axis=(-2, -1))
+
+
+def agreeing_pairs(counts):
+    """
+    number of ordered pairs of coders assigning the same category to a subject
+    :param counts: subjects x categories counts
+    :return: agreeing pairs of each subject
+    """
+    return (counts * (counts - 1)).sum(axis=-1)
+
+
+def subject_agreement(counts):
+    """
+    fraction of the ordered pairs of coders of each subject assigning it the same category,
+    counting only the coders that annotated the subject
+    :param counts: subjects x categories counts
+    :return: agreement of each subject, 0 for subjects with less than two annotations
+    """
+    annotations = counts.sum(axis=-1)
+    return agreeing_pairs(counts) / np.maximum(annotations * (annotations - 1), 1)
+
+
+def mean_agreement(agreement, num_subjects):
+    """
+    observed agreement, the average over the pairable subjects of their agreement
+    :param agreement: sum of the subject_agreement of the subjects
+    :param num_subjects: number of subjects with at least two annotations
+    :return:
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return agreement / num_subjects
+
+
+def chance_corrected_agreement(observed, expected):
+    """
+    (observed - expected) / (1 - expected), perfect agreement is 1 even when expected agreement is 1
+    :param observed: observed agreement
+    :param expected: expected agreement
+    :return:
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        agreement = (observed - expected) / (1.0 - expected)
+    return np.where(np.isclose(expected, 1.0) & np.isclose(observed, 1.0), 1.0, agreement)
+
+
+def scotts_pi(agreement, category_totals, num_subjects):
+    """
+    Scott's pi generalized to multiple coders (Fleiss 1971), expected agreement from the pooled annotations.
+    Missing annotations are skipped, each subject is scored on the coders that annotated it
+    :param agreement: sum of the subject_agreement of the subjects
+    :param category_totals: number of annotations of each category
+    :param num_subjects: number of subjects with at least two annotations
+    :return:
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        expected = ((category_totals / category_totals.sum(axis=-1, keepdims=True)) ** 2).sum(axis=-1)
+    return chance_corrected_agreement(mean_agreement(agreement, num_subjects), expected)
+
+
+def coder_proportions(coder_counts):
+    """
+    distribution of the categories assigned by each coder, over the annotations of the coder
+    :param coder_counts: coders x categories counts
+    :return: coders x categories proportions, 0 for coders without annotations
+    """
+    return coder_counts / np.maximum(coder_counts.sum(axis=-1, keepdims=True), 1)
+
+
+def fleiss_kappa(agreement, coder_counts, num_subjects):
+    """
+    multi-coder kappa (Davies and Fleiss 1982), expected agreement averaged over the coder pairs.
+    Missing annotations are skipped, each subject is scored on the coders that annotated it
+    and each coder contributes the distribution of its own annotations
+    :param agreement: sum of the subject_agreement of the subjects
+    :param coder_counts: coders x categories counts
+    :param num_subjects: number of subjects with at least two annotations
+    :return:
+    """
+    num_coders = (coder_counts.sum(axis=-1) > 0).sum(axis=-1)
+    proportions = coder_proportions(coder_counts)
+    return fleiss_kappa_from_sums(
+        agreement, proportions.sum(axis=-2), (proportions ** 2).sum(axis=-2), num_subjects, num_coders
+    )
+
+
+def fleiss_kappa_from_sums(agreement, proportion_totals, proportion_squares, num_subjects, num_coders):
+    """
+    multi-coder kappa (Davies and Fleiss 1982) from the sums over the coders of their category proportions
+    :param agreement: sum of the subject_agreement of the subjects
+    :param proportion_totals: sum over the coders of the proportion of their annotations in each category
+    :param proportion_squares: sum over the coders of the squared proportions
+    :param num_subjects: number of subjects with at least two annotations
+    :param num_coders: number of coders with annotations
+    :return:
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        expected = (proportion_totals ** 2 - proportion_squares).sum(axis=-1) / (num_coders * (num_coders - 1))
+    return chance_corrected_agreement(mean_agreement(agreement, num_subjects), expected)
+
+
+def one_hot(annotations, num_coders, num_subjects, num_categories):
+    """
+    sparse coders x (subjects * categories) indicator of the annotations
+    :param annotations: (coder, subject, label) triples
+    :param num_coders: number of coders
+    :param num_subjects: number of subjects
+    :param num_categories: size of the codebook
+    :return: scipy.sparse.csr_matrix
+    """
+    import scipy.sparse as sps
+
+    coders, subjects, labels = annotations
+    return sps.csr_matrix(
+        (np.ones(len(coders)), (coders, subjects.astype(np.int64) * num_categories + labels)),
+        shape=(num_coders, num_subjects * num_categories)
+    )
+
+
+def subject_indicator(annotations, num_coders, num_subjects, num_categories):
+    """
+    sparse subjects x (coders * categories) indicator of the annotations of each subject
+    :param annotations: (coder, subject, label) triples
+    :param num_coders: number of coders
+    :param num_subjects: number of subjects
+    :param num_categories: size of the codebook
+    :return: scipy.sparse.csr_matrix
+    """
+    import scipy.sparse as sps
+
+    coders, subjects, labels = annotations
+    return sps.csr_matrix(
+        (np.ones(len(coders)), (subjects, coders.astype(np.int64) * num_categories + labels)),
+        shape=(num_subjects, num_coders * num_categories)
+    )
+
+
+def pairwise_agreement_counts(annotations, num_coders, num_subjects, num_categories):
+    """
+    number of subjects on which each pair of coders assigns the same category, from a single matrix product
+    :param annotations: (coder, subject, label) triples
+    :param num_coders: number of coders
+    :param num_subjects: number of subjects
+    :param num_categories: size of the codebook
+    :return: coders x coders counts, the diagonal holds the annotations of each coder
+    """
+    indicator = one_hot(annotations, num_coders, num_subjects, num_categories)
+    return (indicator @ indicator.T).toarray()
+
+
+def pairwise_shared_counts(annotations, num_coders, num_subjects):
+    """
+    number of subjects annotated by each pair of coders, from a single matrix product
+    :param annotations: (coder, subject, label) triples
+    :param num_coders: number of coders
+    :param num_subjects: number of subjects
+    :return: coders x coders counts, the diagonal holds the annotations of each coder
+    """
+    import scipy.sparse as sps
+
+    coders, subjects, _ = annotations
+    indicator = sps.csr_matrix((np.ones(len(coders)), (coders, subjects)), shape=(num_coders, num_subjects))
+    return (indicator @ indicator.T).toarray()
+
+
+def segment_sums(quantities, segments, num_segments):
+    """
+    sums of per-subject quantities over the subjects of each segment, in a single sparse product
+    :param quantities: subjects x quantities dense or sparse matrix
+    :param segments: segment index of each subject, subjects with a negative index belong to no segment
+    :param num_segments: number of segments
+    :return: segments x quantities
+    """
+    import scipy.sparse as sps
+
+    subjects = np.nonzero(segments >= 0)[0]
+    indicator = sps.csr_matrix(
+        (np.ones(len(subjects)), (segments[subjects], subjects)), shape=(num_segments, len(segments))
+    )
+    sums = indicator @ quantities
+    return sums.toarray() if sps.issparse(sums) else np.asarray(sums)
+
+
+def pairwise_confusion_matrices(annotations, num_coders, num_subjects, num_categories):
+    """
+    confusion matrices of every pair of coders, on the subjects both annotated, from a single sparse product
+    :param annotations: (coder, subject, label) triples
+    :param num_coders: number of coders
+    :param num_subjects: number of subjects
+    :param num_categories: size of the codebook
+    :return: coders x coders x categories x categories counts
+    """
+    indicator = subject_indicator(annotations, num_coders, num_subjects, num_categories)
+    counts = (indicator.T @ indicator).toarray()
+    return counts.reshape(num_coders, num_categories, num_coders, num_categories).transpose(0, 2, 1, 3)
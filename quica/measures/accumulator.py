@@ -0,0 +1,88 @@
+import numpy as np
+from quica.dataset.dataset import IRRDataset
+from quica.internal.statistics import krippendorff_alpha, subject_agreement, coincidence_matrix, fleiss_kappa, \
+    scotts_pi, mean_agreement
+
+__all__ = ["AgreementAccumulator"]
+
+
+class AgreementAccumulator:
+    """
+    running agreement over batches of new subjects annotated by the same coders.
+    Only the sufficient statistics are kept (coincidence matrix, coder x category counts and
+    summed subject agreement), so each update costs O(batch) and the scores match a full
+    recomputation on all the subjects seen so far.
+    """
+
+    def __init__(self):
+        self.label2int = {}
+        self.coders = None
+        self.subjects = 0
+        self.pairable_subjects = 0
+        self.agreement = 0
+        self.coincidence = np.zeros((0, 0))
+        self.coder_counts = None
+
+    def _grow(self, num_categories):
+        missing = num_categories - len(self.coincidence)
+        if missing > 0:
+            self.coincidence = np.pad(self.coincidence, ((0, missing), (0, missing)))
+            self.coder_counts = np.pad(self.coder_counts, ((0, 0), (0, missing)))
+
+    def update(self, batch):
+        """
+        add a batch of new subjects
+        :param batch: one list of labels per coder, a coders x subjects array or a DataFrame with one column per coder
+        :return: the accumulator
+        """
+        dataset = batch if isinstance(batch, IRRDataset) else IRRDataset(batch)
+
+        if self.coders is None:
+            self.coders = dataset.coders
+            self.coder_counts = np.zeros((self.coders, 0), dtype=int)
+        elif dataset.coders != self.coders:
+            raise Exception("Expected batches from {} coders, got {}".format(self.coders, dataset.coders))
+
+        # map the codes of the batch to the running codebook
+        for label in dataset.codebook:
+            self.label2int.setdefault(label, len(self.label2int))
+        self._grow(len(self.label2int))
+        mapping = np.array([self.label2int[label] for label in dataset.codebook], dtype=int)
+
+        counts = np.zeros((dataset.subjects, len(self.label2int)), dtype=int)
+        counts[:, mapping] = dataset.item_counts
+        self.coincidence += coincidence_matrix(counts)
+        self.coder_counts[:, mapping] += dataset.coder_counts
+
+        self.agreement += subject_agreement(counts).sum()
+        self.subjects += dataset.subjects
+        self.pairable_subjects += (counts.sum(axis=1) > 1).sum()
+
+        return self
+
+    def krippendorff(self):
+        return float(krippendorff_alpha(self.coincidence))
+
+    def fleiss(self):
+        return float(fleiss_kappa(self.agreement, self.coder_counts, self.pairable_subjects))
+
+    def scotts(self):
+        return float(scotts_pi(self.agreement, self.coder_counts.sum(axis=0), self.pairable_subjects))
+
+    def raw(self):
+        return float(mean_agreement(self.agreement, self.pairable_subjects))
+
+    def get_results(self):
+        """
+        current scores, in the same format as Quica.get_results
+        :return: pandas.DataFrame
+        """
+        import pandas as pd
+
+        names = ["Krippendorff's Alpha", "Scotts' Kappa", "Raw Agreement", "Fleiss'K"]
+        results = [self.krippendorff(), self.scotts(), self.raw(), self.fleiss()]
+
+        data = pd.DataFrame({"measure": names, "score": results})
+        data.index = data["measure"]
+        del data["measure"]
+        return data
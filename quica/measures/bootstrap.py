@@ -0,0 +1,183 @@
+import numpy as np
+from quica.dataset.dataset import IRRDataset
+from quica.internal.parallel import map_jobs, get_n_jobs
+
+__all__ = ["Bootstrap", "weighted_sums", "leave_one_out_sums"]
+
+# maximum number of replicate weights drawn at once
+CHUNK_SIZE = 2 ** 22
+
+METHODS = ["percentile", "bca"]
+
+
+def weighted_sums(weights, quantities):
+    """
+    sums of the per-subject quantities, weighted by the number of times each subject is drawn
+    :param weights: replicates x subjects weights
+    :param quantities: subjects x quantities dense or sparse matrix
+    :return: replicates x quantities
+    """
+    import scipy.sparse as sps
+
+    if sps.issparse(quantities):
+        return np.asarray((quantities.T @ weights.T).T)
+    return weights @ quantities
+
+
+def leave_one_out_sums(quantities, subjects):
+    """
+    sums of the per-subject quantities with each of the given subjects removed
+    :param quantities: subjects x quantities dense or sparse matrix
+    :param subjects: indices of the removed subjects
+    :return: len(subjects) x quantities
+    """
+    import scipy.sparse as sps
+
+    if sps.issparse(quantities):
+        return np.asarray(quantities.sum(axis=0)) - quantities[subjects].toarray()
+    return quantities.sum(axis=0) - quantities[subjects]
+
+
+def _resampled_score(job):
+    measure, dataset = job
+    return measure.compute_irr(dataset)
+
+
+class Bootstrap:
+    """
+    bootstrap confidence intervals of IRR measures, resampling the subjects with replacement.
+    Measures exposing additive per-subject statistics (IRRMeasure.get_statistic) are resampled by
+    drawing multinomial count weights over the subjects and evaluating all the replicates as
+    batched matrix products, without copying the data. The other measures (MACE) are recomputed
+    on each resampled dataset, on n_jobs worker processes; the resampled datasets are built a few
+    at a time, so that about two copies per worker are held at once.
+
+    :param replicates: number of bootstrap replicates
+    :param confidence: confidence level of the intervals
+    :param method: "percentile" or "bca" (bias-corrected and accelerated); the acceleration of
+                   measures without additive statistics is 0, as it would require a refit per subject
+    :param seed: seed of the resampling
+    :param n_jobs: number of worker processes for the measures without additive statistics
+    """
+
+    def __init__(self, replicates=1000, confidence=0.95, method="percentile", seed=None, n_jobs=1):
+        if method not in METHODS:
+            raise Exception("Unknown bootstrap method {}, use one of {}".format(method, METHODS))
+
+        self.replicates = replicates
+        self.confidence = confidence
+        self.method = method
+        self.seed = seed
+        self.n_jobs = n_jobs
+
+    def get_weights(self, subjects):
+        """
+        multinomial resampling weights, drawn in chunks of replicates
+        :param subjects: number of subjects
+        :return: generator of replicates x subjects weights
+        """
+        random_state = np.random.default_rng(self.seed)
+        chunk = max(1, CHUNK_SIZE // max(subjects, 1))
+        probabilities = np.full(subjects, 1.0 / subjects)
+
+        for start in range(0, self.replicates, chunk):
+            yield random_state.multinomial(subjects, probabilities, size=min(chunk, self.replicates - start))
+
+    def get_replicates(self, dataset: IRRDataset, measures, statistics=None):
+        """
+        bootstrap replicates of each measure, all the measures share the same resampled subjects
+        :param dataset: IRRDataset
+        :param measures: list of IRRMeasure
+        :param statistics: additive statistics of the measures, computed when not given
+        :return: list with the array of replicates of each measure
+        """
+        if statistics is None:
+            statistics = [measure.get_statistic(dataset) for measure in measures]
+        replicates = [[] for _ in measures]
+        batch = 2 * get_n_jobs(self.n_jobs)
+
+        for weights in self.get_weights(dataset.subjects):
+            for index, statistic in enumerate(statistics):
+                if statistic is not None:
+                    quantities, score = statistic
+                    replicates[index].append(score(weighted_sums(weights, quantities)))
+                    continue
+
+                for start in range(0, len(weights), batch):
+                    jobs = [(measures[index], dataset.take(np.repeat(np.arange(dataset.subjects), row)))
+                            for row in weights[start:start + batch]]
+                    replicates[index].append(
+                        map_jobs(_resampled_score, jobs, n_jobs=self.n_jobs, backend="process")
+                    )
+
+        return [np.concatenate(values) if values else np.zeros(0) for values in replicates]
+
+    def get_jackknife(self, dataset: IRRDataset, statistic):
+        """
+        leave-one-subject-out values of a measure, from its additive statistics
+        :param dataset: IRRDataset
+        :param statistic: additive statistics of the measure, as returned by IRRMeasure.get_statistic
+        :return: array of values, or None when the measure has no additive statistics
+        """
+        if statistic is None:
+            return None
+
+        quantities, score = statistic
+        chunk = max(1, CHUNK_SIZE // max(quantities.shape[1], 1))
+        return np.concatenate([
+            score(leave_one_out_sums(quantities, np.arange(start, min(start + chunk, dataset.subjects))))
+            for start in range(0, dataset.subjects, chunk)
+        ])
+
+    def get_interval(self, estimate, replicates, jackknife=None):
+        """
+        confidence interval from the bootstrap replicates
+        :param estimate: value of the measure on the full dataset
+        :param replicates: bootstrap replicates
+        :param jackknife: leave-one-subject-out values, used for the BCa acceleration
+        :return: lower and upper bound
+        """
+        import scipy.special as ssp
+
+        replicates = replicates[np.isfinite(replicates)]
+        if len(replicates) == 0:
+            return np.nan, np.nan
+
+        quantiles = np.array([(1 - self.confidence) / 2, (1 + self.confidence) / 2])
+
+        if self.method == "bca":
+            bias = ssp.ndtri(np.mean(replicates < estimate))
+            acceleration = 0.0
+            if jackknife is not None:
+                jackknife = jackknife[np.isfinite(jackknife)]
+                deviations = jackknife.mean() - jackknife
+                spread = (deviations ** 2).sum() ** 1.5
+                acceleration = (deviations ** 3).sum() / (6 * spread) if spread > 0 else 0.0
+
+            if np.isfinite(bias):
+                z = ssp.ndtri(quantiles)
+                quantiles = ssp.ndtr(bias + (bias + z) / (1 - acceleration * (bias + z)))
+
+        lower, upper = np.percentile(replicates, quantiles * 100)
+        return lower, upper
+
+    def confidence_intervals(self, dataset: IRRDataset, measures, estimates=None):
+        """
+        confidence intervals of the measures
+        :param dataset: IRRDataset
+        :param measures: list of IRRMeasure
+        :param estimates: values of the measures on the full dataset, computed when not given
+        :return: list of (lower, upper) bounds
+        """
+        if estimates is None:
+            estimates = [measure.compute_irr(dataset) for measure in measures]
+
+        statistics = [measure.get_statistic(dataset) for measure in measures]
+        replicates = self.get_replicates(dataset, measures, statistics)
+
+        intervals = []
+        for estimate, statistic, values in zip(estimates, statistics, replicates):
+            jackknife = self.get_jackknife(dataset, statistic) if self.method == "bca" else None
+            intervals.append(self.get_interval(estimate, values, jackknife))
+
+        return intervals
@@ -0,0 +1,79 @@
+"""
+Per-coder diagnostics: the agreement of the other coders when each coder is left out, computed by
+subtracting the contribution of the coder from the statistics of the whole dataset
+"""
+
+import numpy as np
+from quica.dataset.dataset import IRRDataset
+from quica.internal.statistics import nominal_alpha, agreeing_pairs, subject_agreement, mean_agreement, scotts_pi, \
+    fleiss_kappa_from_sums, coder_proportions
+
+__all__ = ["leave_one_coder_out"]
+
+
+def pairable_trace(squares, annotations):
+    """
+    contribution of subjects to the trace of the coincidence matrix, 0 for subjects that are not pairable
+    :param squares: sum over the categories of the squared counts of each subject
+    :param annotations: number of annotations of each subject
+    :return:
+    """
+    return np.where(annotations > 1, (squares - annotations) / np.maximum(annotations - 1, 1), 0.0)
+
+
+def leave_one_coder_out(dataset: IRRDataset):
+    """
+    Krippendorff's alpha, Fleiss' kappa, Scott's pi and raw agreement of the dataset without each coder.
+    Removing a coder only changes the subjects it annotated, so all the scores come from one pass over the
+    annotations and the cached subject x category and coder x category counts
+    :param dataset: IRRDataset with at least three coders
+    :return: dict from measure name to the array of its values without each coder
+    """
+    import scipy.sparse as sps
+
+    categories = len(dataset.codebook)
+    counts = dataset.item_counts
+    coder_counts = dataset.coder_counts
+    coders, subjects, labels = dataset.annotations
+    coders, subjects, labels = coders.astype(np.int64), subjects.astype(np.int64), labels.astype(np.int64)
+
+    annotations = counts.sum(axis=1)
+    squares = (counts ** 2).sum(axis=1)
+    label_counts = counts[subjects, labels]
+    before, after = annotations[subjects], annotations[subjects] - 1
+
+    def per_coder(weights):
+        return np.bincount(coders, weights=weights, minlength=dataset.coders)
+
+    # Krippendorff's alpha: trace and marginals of the coincidence matrix
+    trace = pairable_trace(squares, annotations).sum() + per_coder(
+        pairable_trace(squares[subjects] - 2 * label_counts + 1, after) - pairable_trace(squares[subjects], before)
+    )
+    pairable = sps.csr_matrix(
+        ((after > 1).astype(float) - (before > 1), (coders, subjects)), shape=(dataset.coders, dataset.subjects)
+    )
+    removed = np.bincount(coders * categories + labels, weights=(after > 1).astype(float),
+                          minlength=dataset.coders * categories).reshape(dataset.coders, categories)
+    marginals = (counts * (annotations > 1)[:, None]).sum(axis=0) + pairable @ counts - removed
+
+    # subject agreement over the remaining coders, pairable subjects and coder distributions of the kappas
+    agreements = subject_agreement(counts)
+    remaining_agreement = (agreeing_pairs(counts)[subjects] - 2.0 * (label_counts - 1)) / \
+        np.maximum(after * (after - 1), 1)
+    agreement = agreements.sum() + per_coder(remaining_agreement - agreements[subjects])
+    pairable_subjects = (annotations > 1).sum() - per_coder((after == 1).astype(float))
+    active = coder_counts.sum(axis=1) > 0
+    remaining = active.sum() - active
+    totals = coder_counts.sum(axis=0) - coder_counts
+    proportions = coder_proportions(coder_counts)
+    proportion_totals = proportions.sum(axis=0) - proportions
+    proportion_squares = (proportions ** 2).sum(axis=0) - proportions ** 2
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "Krippendorff's Alpha": nominal_alpha(trace, marginals),
+            "Fleiss'K": fleiss_kappa_from_sums(agreement, proportion_totals, proportion_squares, pairable_subjects,
+                                               remaining),
+            "Scotts' Kappa": scotts_pi(agreement, totals, pairable_subjects),
+            "Raw Agreement": mean_agreement(agreement, pairable_subjects),
+        }
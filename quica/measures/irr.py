@@ -1,14 +1,21 @@
 from abc import ABC, abstractmethod
-import krippendorff
 from quica.dataset.dataset import IRRDataset
-from sklearn.metrics import cohen_kappa_score
-from nltk import agreement
-from itertools import combinations
-from quica.internal.measures import *
-from sklearn.metrics import accuracy_score
+from quica.internal.statistics import MISSING, LEVELS, nominal_sums, nominal_alpha, distance_matrix, \
+    weighted_alpha, subject_coincidences, category_ranks, cohens_kappa, kappa_weights, confusion_matrix, \
+    paired_cells, subject_agreement, mean_agreement, fleiss_kappa, scotts_pi, \
+    pairwise_agreement_counts, pairwise_shared_counts, subject_indicator, pairwise_confusion_matrices
 import numpy as np
 
+__all__ = ["IRRMeasure", "Krippendorff", "CohensK", "FleissK", "ScottsPI", "RawAgreement", "MaceIRR"]
+
 class IRRMeasure(ABC):
+    """
+    agreement measure. name labels the measure in the results and cost is its rough cost class,
+    "fast" for closed-form measures and "slow" for measures fit iteratively
+    """
+
+    name = None
+    cost = "fast"
 
     def __init__(self):
         super().__init__()
@@ -17,88 +24,411 @@ class IRRMeasure(ABC):
     def compute_irr(self, dataset):
         pass
 
+    def applies_to(self, dataset):
+        """
+        whether the measure is reported by default on a dataset
+        :param dataset: IRRDataset
+        :return:
+        """
+        return True
+
+    def is_deterministic(self):
+        """
+        whether the measure always gives the same result on the same dataset, only such results are cached on disk
+        :return:
+        """
+        return True
+
+    def compute_within(self, dataset, deadline):
+        """
+        compute the measure, stopping with a TimeoutError after the deadline.
+        Measures that cannot be interrupted ignore the deadline
+        :param dataset: IRRDataset
+        :param deadline: time.time() after which the computation is aborted
+        :return:
+        """
+        return self.compute_irr(dataset)
+
+    def get_segment_statistic(self, dataset, codebooks):
+        """
+        get_statistic of a dataset stacked from datasets with their own codebooks (stack_tasks),
+        where the codes of the subjects of each segment index the codebook of the segment.
+        Measures that only compare the codes use the statistic of the stacked dataset
+        :param dataset: stacked IRRDataset
+        :param codebooks: codebook of each segment
+        :return: as get_statistic, the function of the sums takes one row of sums per segment
+        """
+        return self.get_statistic(dataset)
+
+    def get_statistic(self, dataset):
+        """
+        per-subject additive quantities of the measure and the function computing the measure
+        from their (weighted) sums over the subjects, used to resample the measure without copying
+        the data. Measures that are not a function of such sums return None.
+        :param dataset: IRRDataset
+        :return: tuple of a subjects x quantities (sparse) matrix and a function of the sums, or None
+        """
+        return None
+
 
 class Krippendorff(IRRMeasure):
-    def __init__(self):
+    """
+    Krippendorff's alpha at a level of measurement: nominal, ordinal (categories ranked by their numeric
+    value, or by the codebook), interval or ratio (numeric labels). Every level is computed from the cached
+    coincidence matrix of the dataset with a categories x categories distance matrix
+    :param level: level of measurement, one of LEVELS
+    :param order: labels from the lowest to the highest, ranking the categories of the ordinal level
+    """
+    name = "Krippendorff's Alpha"
+
+    def __init__(self, level="nominal", order=None):
         super().__init__()
+        if level not in LEVELS:
+            raise Exception("Unknown level of measurement {}, use one of {}".format(level, LEVELS))
+        self.level = level
+        self.order = order
+        if level != "nominal":
+            self.name = "Krippendorff's Alpha ({})".format(level)
+
+    def values(self, codebook):
+        """
+        numeric values of the labels, used by the interval and ratio levels
+        """
+        if self.level not in ["interval", "ratio"]:
+            return None
+        try:
+            return np.asarray(codebook, dtype=float)
+        except (TypeError, ValueError):
+            raise Exception("{} Krippendorff's alpha needs numeric labels".format(self.level.capitalize()))
+
+    def ranks(self, codebook):
+        """
+        ranks of the categories, used by the ordinal level
+        """
+        return category_ranks(codebook, self.order) if self.level == "ordinal" else None
+
+    def score(self, coincidence, values, ranks):
+        """
+        alpha of (a batch of) coincidence matrices, ranks with one row per coincidence matrix rank each of them
+        """
+        marginals = coincidence.sum(axis=-1)
+        if ranks is not None and ranks.ndim > 1:
+            distance = np.stack([distance_matrix(self.level, None, marginals[segment], ranks[segment])
+                                 for segment in range(len(ranks))])
+        else:
+            distance = distance_matrix(self.level, values, marginals, ranks)
+        return weighted_alpha(coincidence, distance)
 
     def compute_irr(self, dataset: IRRDataset):
-        return krippendorff.alpha(dataset.data, level_of_measurement="nominal")
+        if self.level == "nominal":
+            trace, marginals = nominal_sums(dataset.item_counts)
+            return nominal_alpha(trace.sum(), marginals.sum(axis=0))
+        return self.score(dataset.coincidence, self.values(dataset.codebook), self.ranks(dataset.codebook))
+
+    def get_segment_statistic(self, dataset: IRRDataset, codebooks):
+        if self.level == "nominal":
+            return self.get_statistic(dataset)
+
+        # values and ranks of the codes of each segment, the codes past the codebook of a segment are never used
+        categories = len(dataset.codebook)
+        values = np.zeros((len(codebooks), categories))
+        ranks = np.tile(np.arange(categories), (len(codebooks), 1))
+        for segment, codebook in enumerate(codebooks):
+            if self.level == "ordinal":
+                ranks[segment, :len(codebook)] = self.ranks(codebook)
+            else:
+                values[segment, :len(codebook)] = self.values(codebook)
+        return self.get_statistic(dataset, values, ranks if self.level == "ordinal" else None)
+
+    def get_statistic(self, dataset: IRRDataset, values=None, ranks=None):
+        """
+        :param dataset: IRRDataset
+        :param values: numeric values of the categories, optionally one row per segment, the codebook by default
+        :param ranks: ranks of the categories, optionally one row per segment, the codebook by default
+        :return:
+        """
+        if self.level != "nominal":
+            categories = len(dataset.codebook)
+            values = self.values(dataset.codebook) if values is None else values
+            ranks = self.ranks(dataset.codebook) if ranks is None else ranks
+            return subject_coincidences(dataset.item_counts), \
+                lambda sums: self.score(sums.reshape(sums.shape[:-1] + (categories, categories)), values, ranks)
+
+        # trace and marginals of the coincidence matrix
+        trace, marginals = nominal_sums(dataset.item_counts)
+        quantities = np.column_stack([trace, marginals])
+        return quantities, lambda sums: nominal_alpha(sums[..., 0], sums[..., 1:])
 
 class CohensK(IRRMeasure):
-    def __init__(self):
+    """
+    Cohen's kappa, unweighted or weighted by the distance between the ranks of the categories,
+    ranked by their numeric value or by the codebook
+    :param weights: None, "linear" or "quadratic"
+    :param order: labels from the lowest to the highest, ranking the categories of weighted kappa
+    """
+    name = "Cohen's K"
+
+    def __init__(self, weights=None, order=None):
         super().__init__()
+        kappa_weights(2, weights)
+        self.weights = weights
+        self.order = order
+        if weights is not None:
+            self.name = "Cohen's K ({})".format(weights)
+
+    def get_weights(self, codebook):
+        """
+        disagreement weights of the categories of a codebook
+        """
+        ranks = category_ranks(codebook, self.order) if self.weights is not None else None
+        return kappa_weights(len(codebook), self.weights, ranks)
+
+    def applies_to(self, dataset: IRRDataset):
+        return dataset.coders == 2
 
     def compute_irr(self, dataset: IRRDataset):
 
         if dataset.coders > 2:
             raise Exception("Cohen's K supported only for two coders")
 
-        return cohen_kappa_score(dataset.get_coder(0), dataset.get_coder(1))
+        codes = dataset.codes
+        categories = len(dataset.codebook)
+        return cohens_kappa(confusion_matrix(codes[0], codes[1], categories), self.get_weights(dataset.codebook))
+
+    def get_segment_statistic(self, dataset: IRRDataset, codebooks):
+        if self.weights is None:
+            return self.get_statistic(dataset)
+
+        # weights of the codes of each segment, the codes past the codebook of a segment are never used
+        categories = len(dataset.codebook)
+        weights = np.tile(kappa_weights(categories, self.weights), (len(codebooks), 1, 1))
+        for segment, codebook in enumerate(codebooks):
+            weights[segment, :len(codebook), :len(codebook)] = self.get_weights(codebook)
+        return self.get_statistic(dataset, weights)
+
+    def get_statistic(self, dataset: IRRDataset, weights=None):
+        """
+        :param dataset: IRRDataset with two coders
+        :param weights: disagreement weights, optionally one matrix per segment, from the codebook by default
+        :return:
+        """
+        import scipy.sparse as sps
+
+        if dataset.coders > 2:
+            raise Exception("Cohen's K supported only for two coders")
+
+        categories = len(dataset.codebook)
+        codes = dataset.codes
+        cells = paired_cells(codes[0], codes[1], categories)
+        paired = np.nonzero(cells != MISSING)[0]
+        quantities = sps.csr_matrix(
+            (np.ones(len(paired)), (paired, cells[paired])), shape=(dataset.subjects, categories ** 2)
+        )
+        weights = self.get_weights(dataset.codebook) if weights is None else weights
+        return quantities, \
+            lambda sums: cohens_kappa(sums.reshape(sums.shape[:-1] + (categories, categories)), weights)
+
+    def pairwise(self, dataset: IRRDataset):
+        """
+        Cohen's kappa of every pair of coders, each on the subjects both coders annotated
+        :param dataset: IRRDataset with any number of coders
+        :return: coders x coders pandas.DataFrame
+        """
+        import pandas as pd
+
+        categories = len(dataset.codebook)
+        confusion = pairwise_confusion_matrices(dataset.annotations, dataset.coders, dataset.subjects, categories)
+        kappas = cohens_kappa(confusion, self.get_weights(dataset.codebook))
+        return pd.DataFrame(kappas, index=dataset.coder_names, columns=dataset.coder_names)
+
+
+def agreement_totals(dataset: IRRDataset):
+    """
+    summed subject agreement and number of pairable subjects of a dataset
+    :param dataset: IRRDataset
+    :return:
+    """
+    counts = dataset.item_counts
+    return subject_agreement(counts).sum(), (counts.sum(axis=1) > 1).sum()
+
+
+def agreement_statistic(dataset: IRRDataset):
+    """
+    per-subject agreement, pairable flag and coder x category indicator, the additive
+    quantities of Fleiss' kappa and Scott's pi
+    :param dataset: IRRDataset
+    :return: sparse subjects x (2 + coders * categories) matrix and a function splitting their sums
+    """
+    import scipy.sparse as sps
+
+    counts = dataset.item_counts
+    quantities = sps.hstack([
+        np.column_stack([subject_agreement(counts), counts.sum(axis=1) > 1]),
+        subject_indicator(dataset.annotations, dataset.coders, dataset.subjects, len(dataset.codebook)),
+    ]).tocsr()
+
+    def split(sums):
+        coder_counts = sums[..., 2:].reshape(sums.shape[:-1] + (dataset.coders, len(dataset.codebook)))
+        return sums[..., 0], sums[..., 1], coder_counts
+
+    return quantities, split
 
 
 class FleissK(IRRMeasure):
     """
-    taking strong inspiration from: https://learnaitech.com/how-to-compute-inter-rater-reliablity-metrics-cohens-kappa-fleisss-kappa-cronbach-alpha-kripndorff-alpha-scotts-pi-inter-class-correlation-in-python/
+    multi-coder kappa of Davies and Fleiss, as computed by nltk's AnnotationTask.multi_kappa on complete data,
+    from the subject x category and coder x category counts. Subjects are scored on the coders that annotated them
     """
+    name = "Fleiss'K"
+
     def __init__(self):
         super().__init__()
 
-    def compute_irr(self, dataset: IRRDataset):
+    def applies_to(self, dataset: IRRDataset):
+        return dataset.coders != 2
 
-        formatted_codes = []
+    def compute_irr(self, dataset: IRRDataset):
+        agreement, subjects = agreement_totals(dataset)
+        return float(fleiss_kappa(agreement, dataset.coder_counts, subjects))
 
-        for i in range(0, dataset.coders):
-            coder_data = dataset.get_coder(i)
-            data_formatted = [[i, n, coder_data[n]] for n in range(len(coder_data))]
-            formatted_codes.extend(data_formatted)
+    def get_statistic(self, dataset: IRRDataset):
+        quantities, split = agreement_statistic(dataset)
 
-        ratingtask = agreement.AnnotationTask(data=formatted_codes)
+        def score(sums):
+            agreement, subjects, coder_counts = split(sums)
+            return fleiss_kappa(agreement, coder_counts, subjects)
 
-        return ratingtask.multi_kappa()
+        return quantities, score
 
 class ScottsPI(IRRMeasure):
     """
-    taking strong inspiration from: https://learnaitech.com/how-to-compute-inter-rater-reliablity-metrics-cohens-kappa-fleisss-kappa-cronbach-alpha-kripndorff-alpha-scotts-pi-inter-class-correlation-in-python/
+    multi-coder Scott's pi, as computed by nltk's AnnotationTask.pi on complete data,
+    from the subject x category counts. Subjects are scored on the coders that annotated them
     """
+    name = "Scotts' Kappa"
+
     def __init__(self):
         super().__init__()
 
     def compute_irr(self, dataset: IRRDataset):
+        agreement, subjects = agreement_totals(dataset)
+        return float(scotts_pi(agreement, dataset.item_counts.sum(axis=0), subjects))
 
-        formatted_codes = []
-
-        for i in range(0, dataset.coders):
-            coder_data = dataset.get_coder(i)
-            data_formatted = [[i, n, coder_data[n]] for n in range(len(coder_data))]
-            formatted_codes.extend(data_formatted)
+    def get_statistic(self, dataset: IRRDataset):
+        quantities, split = agreement_statistic(dataset)
 
-        ratingtask = agreement.AnnotationTask(data=formatted_codes)
+        def score(sums):
+            agreement, subjects, coder_counts = split(sums)
+            return scotts_pi(agreement, coder_counts.sum(axis=-2), subjects)
 
-        return ratingtask.pi()
+        return quantities, score
 
 class RawAgreement(IRRMeasure):
+    """
+    fraction of the pairs of coders of a subject that assign it the same category, averaged over the subjects
+    annotated by at least two coders, computed from the subject x category counts.
+    Missing annotations are skipped, each subject is scored on the coders that annotated it
+    """
+    name = "Raw Agreement"
 
     def __init__(self):
         super().__init__()
 
     def compute_irr(self, dataset: IRRDataset):
-
-        comb = combinations(dataset.data, 2)
-
-        return np.mean([accuracy_score(a,b) for a,b in comb])
+        agreement, subjects = agreement_totals(dataset)
+        return float(mean_agreement(agreement, subjects))
+
+    def get_statistic(self, dataset: IRRDataset):
+        counts = dataset.item_counts
+        quantities = np.column_stack([subject_agreement(counts), counts.sum(axis=1) > 1])
+        return quantities, lambda sums: mean_agreement(sums[..., 0], sums[..., 1])
+
+    def pairwise(self, dataset: IRRDataset):
+        """
+        raw agreement of every pair of coders, each on the subjects both coders annotated
+        :param dataset: IRRDataset
+        :return: coders x coders pandas.DataFrame
+        """
+        import pandas as pd
+
+        counts = pairwise_agreement_counts(dataset.annotations, dataset.coders, dataset.subjects, len(dataset.codebook))
+        shared = pairwise_shared_counts(dataset.annotations, dataset.coders, dataset.subjects)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            agreement = counts / shared
+        return pd.DataFrame(agreement, index=dataset.coder_names, columns=dataset.coder_names)
 
 class MaceIRR(IRRMeasure):
+    """
+    average competence of the coders, estimated with MACE
+    :param n_jobs: number of workers running the random restarts, None or -1 uses all the cores
+    :param seed: seed of the random restarts, set it to get reproducible results
+    :param tolerance: stop each restart when the relative change of the likelihood is below it,
+                      None runs a fixed number of iterations
+    :param dtype: float type of the MACE E-step arrays, numpy.float32 halves their memory
+    :param hook: called with the restart and iteration events of MACE, see Mace. Fits running on worker
+                 processes (n_jobs of get_group_results or Bootstrap) do not call it
+    :param initial_state: state of a previous MACE fit (Mace.get_state) to warm-start from with a single restart
+    :param incremental: with an initial_state, fit only the new subjects, keeping the expected counts of the state
+    """
+    name = "MACE"
+    cost = "slow"
 
-    def __init__(self):
+    def __init__(self, n_jobs=1, seed=None, tolerance=None, dtype=np.float64, hook=None, initial_state=None,
+                 incremental=False):
         super().__init__()
+        self.n_jobs = n_jobs
+        self.seed = seed
+        self.tolerance = tolerance
+        self.dtype = dtype
+        self.hook = hook
+        self.initial_state = initial_state
+        self.incremental = incremental
+
+    def __getstate__(self):
+        # as for Mace, the hook is only called in the process that owns the measure,
+        # so groups and bootstrap replicates can be fit on a process pool with any callable
+        state = dict(self.__dict__)
+        state["hook"] = None
+        return state
+
+    def is_deterministic(self):
+        return self.seed is not None
+
+    def compute_within(self, dataset, deadline):
+        return self.compute_irr(dataset, deadline=deadline)
+
+    def compute_irr(self, dataset, n_jobs=None, seed=None, deadline=None):
+        # as the closed-form measures, no annotations give no agreement
+        if len(dataset.annotations[0]) == 0:
+            return np.nan
+        algo = self.fit(dataset, n_jobs, seed, deadline)
+        return np.mean(algo.competence[:, 1])
 
-    def compute_irr(self, dataset):
-
-        dataframe = pd.DataFrame(data=np.array(dataset.data).T).applymap(lambda x : str(x))
-
-        algo = Mace(
-            inputfile=dataframe,
+    def fit(self, dataset, n_jobs=None, seed=None, deadline=None):
+        """
+        fit MACE on a dataset, e.g. to save its state (Mace.get_state) and warm-start the next fit
+        :param dataset: IRRDataset
+        :param n_jobs: number of workers, defaults to the one of the measure
+        :param seed: seed of the random restarts, defaults to the one of the measure
+        :param deadline: time.time() after which the fit stops with a TimeoutError
+        :return: fitted Mace
+        """
+        from quica.internal.measures import Mace, ALPHA, BETA, EM, ITERATIONS, RESTARTS, THRESHOLD
+
+        # MACE works on the codes of the dataset, restricted to the labels in use
+        coders, subjects, codes = dataset.annotations
+        if len(codes) == 0:
+            raise Exception("MACE needs at least one annotation")
+        used = np.unique(codes)
+
+        algo = Mace.from_annotations(
+            instances=subjects,
+            annotators=coders,
+            labels=np.searchsorted(used, codes),
+            num_instances=dataset.subjects,
+            num_annotators=dataset.coders,
+            unique_labels=dataset.codebook[used].tolist(),
+            annotator_names=dataset.coder_names,
             priors={},
             alpha=ALPHA,
             beta=BETA,
@@ -108,9 +438,15 @@ class MaceIRR(IRRMeasure):
             restarts=RESTARTS,
             threshold=THRESHOLD,
             smoothing=0,
+            seed=self.seed if seed is None else seed,
+            n_jobs=self.n_jobs if n_jobs is None else n_jobs,
+            tolerance=self.tolerance,
+            deadline=deadline,
+            dtype=self.dtype,
+            hook=self.hook,
         )
-        algo.fit()
-        return np.mean(algo.competence[:, 1])
+        algo.fit(self.initial_state, self.incremental)
+        return algo
 
 
 
@@ -0,0 +1,76 @@
+"""
+Registry of the measures reported by Quica, looked up by key
+"""
+
+from quica.measures.irr import IRRMeasure, Krippendorff, ScottsPI, RawAgreement, MaceIRR, CohensK, FleissK
+
+__all__ = ["COSTS", "MEASURES", "register", "get_measure", "get_name", "select_measures"]
+
+# cost classes, from the cheapest
+COSTS = ["fast", "slow"]
+
+MEASURES = {}
+
+
+def register(key, measure):
+    """
+    register a measure, so that it is reported by default and can be selected by key
+    :param key: key of the measure
+    :param measure: IRRMeasure subclass, built without arguments
+    :return: the measure
+    """
+    MEASURES[key] = measure
+    return measure
+
+
+def get_measure(measure):
+    """
+    :param measure: registry key, IRRMeasure subclass or instance
+    :return: IRRMeasure instance
+    """
+    if isinstance(measure, IRRMeasure):
+        return measure
+    if isinstance(measure, type) and issubclass(measure, IRRMeasure):
+        return measure()
+    if measure not in MEASURES:
+        raise Exception("Unknown measure {}, use one of {}".format(measure, list(MEASURES)))
+    return MEASURES[measure]()
+
+
+def get_name(measure):
+    """
+    label of a measure in the results, its name or its class name
+    :param measure: IRRMeasure
+    :return:
+    """
+    return measure.name if measure.name is not None else type(measure).__name__
+
+
+def select_measures(dataset, measures=None, cost=None):
+    """
+    measures to compute on a dataset
+    :param dataset: IRRDataset
+    :param measures: registry keys, IRRMeasure subclasses or instances, None selects the registered
+                     measures that apply to the dataset
+    :param cost: highest cost class to keep, e.g. "fast" leaves MACE out, None keeps all of them
+    :return: list of IRRMeasure and list of their names
+    """
+    if measures is None:
+        selected = [measure for measure in map(get_measure, MEASURES) if measure.applies_to(dataset)]
+    else:
+        selected = [get_measure(measure) for measure in measures]
+
+    if cost is not None:
+        if cost not in COSTS:
+            raise Exception("Unknown cost class {}, use one of {}".format(cost, COSTS))
+        selected = [measure for measure in selected if COSTS.index(measure.cost) <= COSTS.index(cost)]
+
+    return selected, [get_name(measure) for measure in selected]
+
+
+register("krippendorff", Krippendorff)
+register("scotts", ScottsPI)
+register("raw", RawAgreement)
+register("mace", MaceIRR)
+register("cohen", CohensK)
+register("fleiss", FleissK)
@@ -1,12 +1,71 @@
 """Main module."""
 
-from quica.dataset.dataset import IRRDataset
-from quica.measures.irr import *
-import pandas as pd
+from quica.dataset.dataset import IRRDataset, stack_tasks
+from quica.measures.irr import IRRMeasure, Krippendorff, CohensK, FleissK, ScottsPI, RawAgreement, MaceIRR
+from quica.measures.registry import select_measures
+from quica.measures.diagnostics import leave_one_coder_out
+from quica.internal.parallel import map_jobs
+from quica.internal.statistics import segment_sums
+from quica.internal.cache import ResultCache, dataset_fingerprint, parameters_key
+from quica.internal.profiling import Profile
+import os
+import time
+import numpy as np
+
+__all__ = ["Quica", "IRRDataset", "IRRMeasure", "Krippendorff", "CohensK", "FleissK", "ScottsPI", "RawAgreement",
+           "MaceIRR", "segmented_results"]
+
+def _compute_irr(job):
+    measure, dataset = job
+    return measure.compute_irr(dataset)
+
+
+def segmented_results(dataset, segments, datasets, measures, n_jobs=1, codebooks=None, num_segments=None):
+    """
+    measures of each segment of the subjects of a dataset. The measures with additive statistics are computed for
+    all the segments in a single pass, the others (MACE) on the dataset of each segment, on n_jobs worker processes
+    :param dataset: IRRDataset
+    :param segments: segment index of each subject of the dataset, -1 for subjects of no segment
+    :param datasets: dataset of each segment, or a function building them, called only when a measure
+                     has no additive statistic
+    :param measures: list of IRRMeasure
+    :param n_jobs: number of worker processes, None or -1 uses all the cores
+    :param codebooks: codebook of each segment, when the dataset was stacked from datasets with their own codebooks
+    :param num_segments: number of segments, needed when datasets is a function
+    :return: list with the array of the values of each measure on the segments
+    """
+    num_segments = len(datasets) if num_segments is None else num_segments
+
+    results = []
+    for measure in measures:
+        if codebooks is None:
+            statistic = measure.get_statistic(dataset)
+        else:
+            statistic = measure.get_segment_statistic(dataset, codebooks)
+        if statistic is None:
+            if callable(datasets):
+                datasets = datasets()
+            jobs = [(measure, segment) for segment in datasets]
+            results.append(np.asarray(map_jobs(_compute_irr, jobs, n_jobs=n_jobs, backend="process"), dtype=float))
+        else:
+            quantities, score = statistic
+            results.append(score(segment_sums(quantities, segments, num_segments)))
+    return results
+
 
 class Quica:
+    """
+    agreement report of a dataset. Results are memoized on the instance, so exporting the same
+    results in several formats computes them once, and optionally cached on disk, keyed by a hash
+    of the encoded dataset, the measure and its parameters (e.g. the MACE seed). Results that change
+    from run to run, MACE or bootstrap intervals without a seed, are not cached on disk
 
-    def __init__(self, dataset: IRRDataset = None, dataframe: pd.DataFrame = None):
+    :param dataset: IRRDataset
+    :param dataframe: pandas.DataFrame with one column per coder, used when no dataset is given
+    :param cache: optional ResultCache, or the directory of one (str or path)
+    """
+
+    def __init__(self, dataset: IRRDataset = None, dataframe=None, cache=None):
 
         if dataset is not None and dataframe is not None:
             raise Exception("No input option selected, add a dataset or a dataframe")
@@ -14,7 +73,40 @@ class Quica:
         if dataset is not None:
             self.dataset = dataset
         else:
-            self.dataset = IRRDataset(dataframe.values.T)
+            self.dataset = IRRDataset(dataframe)
+
+        self.cache = ResultCache(cache) if isinstance(cache, (str, os.PathLike)) else cache
+        self.results = {}
+        self.fingerprint = None
+
+    def get_cached(self, key, persistent=True):
+        """
+        memoized or cached result
+        :param key: key of the result, e.g. the parameters_key of the measure
+        :param persistent: whether to look up the result in the on-disk cache
+        :return: the result, None when it was never computed
+        """
+        if key not in self.results and self.cache is not None and persistent:
+            if self.fingerprint is None:
+                self.fingerprint = dataset_fingerprint(self.dataset)
+            result = self.cache.get(self.fingerprint, key)
+            if result is not None:
+                self.results[key] = result
+        return self.results.get(key)
+
+    def set_cached(self, key, result, persistent=True):
+        """
+        memoize a result and cache it on disk
+        :param key: key of the result
+        :param result: json serializable result
+        :param persistent: whether to write the result to the on-disk cache, False for results
+                           that are not reproducible
+        """
+        self.results[key] = result
+        if self.cache is not None and persistent:
+            if self.fingerprint is None:
+                self.fingerprint = dataset_fingerprint(self.dataset)
+            self.cache.set(result, self.fingerprint, key)
 
     def save_to_csv(self, csv_path):
         df = self.get_results()
@@ -24,25 +116,158 @@ class Quica:
         df = self.get_results()
         return df.to_latex()
 
-    def get_results(self):
-        measures = [Krippendorff(), ScottsPI(), RawAgreement(), MaceIRR()]
-        names = ["Krippendorff's Alpha", "Scotts' Kappa", "Raw Agreement", "MACE"]
+    def get_results(self, bootstrap=None, measures=None, cost=None, time_budget=None, profile=False,
+                    hook=None):
+        """
+        compute the measures
+        :param bootstrap: optional Bootstrap, adds the ci_lower and ci_upper columns with its confidence intervals
+        :param measures: registry keys, IRRMeasure subclasses or instances to compute,
+                         None computes the registered measures that apply to the dataset
+        :param cost: highest cost class of the measures, e.g. "fast" leaves MACE out
+        :param time_budget: seconds given to each measure, measures that can be interrupted (MACE)
+                            are aborted past it and scored NaN
+        :param profile: add the wall_time, cpu_time (seconds) and peak_memory (bytes) columns of each measure
+        :param hook: called as hook("measure", data) after each measure, with its name, score and profile.
+                     Pass the same hook to MaceIRR to also get the restarts and iterations of MACE
+        :return: pandas.DataFrame with one row per measure
+        """
+        import pandas as pd
 
-        if self.dataset.coders == 2:
-            measures.append(CohensK())
-            names.append("Cohen's K")
-        else:
-            measures.append(FleissK())
-            names.append("Fleiss'K")
+        measures, names = select_measures(self.dataset, measures, cost)
+
+        results, computed, profiles = [], [], []
+        for index, (measure, name) in enumerate(zip(measures, names)):
+            key = parameters_key(measure)
+            persistent = measure.is_deterministic()
+
+            with Profile(profile or hook is not None) as profiled:
+                result = self.get_cached(key, persistent)
+                if result is None:
+                    try:
+                        if time_budget is None:
+                            result = float(measure.compute_irr(self.dataset))
+                        else:
+                            result = float(measure.compute_within(self.dataset, time.time() + time_budget))
+                        self.set_cached(key, result, persistent)
+                    except TimeoutError:
+                        pass
 
-        results = []
-        for measure in measures:
-            results.append(measure.compute_irr(self.dataset))
+            if result is None:
+                results.append(np.nan)
+            else:
+                results.append(result)
+                computed.append(index)
+
+            if profile:
+                profiles.append(profiled.as_dict())
+            if hook is not None:
+                hook("measure", dict(profiled.as_dict(), measure=name, score=results[-1]))
 
         data = pd.DataFrame({"measure": names, "score": results})
+
+        if bootstrap is not None:
+            keys = {index: parameters_key(measures[index]) + parameters_key(bootstrap) for index in computed}
+            persistent = {index: measures[index].is_deterministic() and bootstrap.seed is not None
+                          for index in computed}
+            missing = [index for index in computed if self.get_cached(keys[index], persistent[index]) is None]
+            if missing:
+                intervals = bootstrap.confidence_intervals(
+                    self.dataset, [measures[index] for index in missing], [results[index] for index in missing]
+                )
+                for index, interval in zip(missing, intervals):
+                    self.set_cached(keys[index], [float(bound) for bound in interval], persistent[index])
+
+            bounds = np.full((len(measures), 2), np.nan)
+            for index in computed:
+                bounds[index] = self.get_cached(keys[index], persistent[index])
+            data["ci_lower"] = bounds[:, 0]
+            data["ci_upper"] = bounds[:, 1]
+
+        if profile:
+            for column in ["wall_time", "cpu_time", "peak_memory"]:
+                data[column] = [values[column] for values in profiles]
+
         data.index = data["measure"]
         del data["measure"]
         return data
 
+    @staticmethod
+    def get_batch_results(tasks, n_jobs=1, measures=None, cost=None):
+        """
+        compute all the measures on many annotation tasks of the same coders, e.g. the label fields of a project.
+        The tasks are stacked in a single dataset and the measures with additive statistics are computed for all
+        the tasks at once, summing their per-subject statistics over the subjects of each task. MACE is fit on
+        each task separately, on n_jobs worker processes
+        :param tasks: dict from task name to IRRDataset or DataFrame with one column per coder, or a DataFrame
+                      with (task, coder) MultiIndex columns
+        :param n_jobs: number of worker processes fitting MACE, None or -1 uses all the cores
+        :param measures: measures to compute, as in get_results
+        :param cost: highest cost class of the measures, as in get_results
+        :return: pandas.DataFrame with one row per task and one column per measure
+        """
+        import pandas as pd
+
+        if isinstance(tasks, pd.DataFrame):
+            tasks = {task: tasks[task] for task in tasks.columns.get_level_values(0).unique()}
+
+        datasets = [task if isinstance(task, IRRDataset) else IRRDataset(task) for task in tasks.values()]
+        stacked, segments = stack_tasks(datasets)
+        measures, names = select_measures(stacked, measures, cost)
+        codebooks = [dataset.codebook for dataset in datasets]
+        results = segmented_results(stacked, segments, datasets, measures, n_jobs, codebooks)
+
+        return pd.DataFrame(dict(zip(names, results)), index=pd.Index(list(tasks), name="task"), columns=names)
+
+    def get_group_results(self, by, n_jobs=1, measures=None, cost=None):
+        """
+        compute all the measures on each group of subjects, e.g. per annotation batch, day or data source.
+        The dataset is encoded once: the measures with additive statistics are computed for all the groups in a
+        single segmented pass and MACE is fit on each group on n_jobs worker processes
+        :param by: group of each subject, or a list with one such array per grouping key.
+                   Subjects with a missing group are left out
+        :param n_jobs: number of worker processes fitting MACE, None or -1 uses all the cores
+        :param measures: measures to compute, as in get_results
+        :param cost: highest cost class of the measures, as in get_results
+        :return: pandas.DataFrame with one row per group and measure
+        """
+        import pandas as pd
+
+        keys = list(by) if isinstance(by, list) and len(by) > 0 and np.ndim(by[0]) == 1 else [by]
+        values = [np.asarray(key, dtype=object) for key in keys]
+        grouped = np.nonzero(~np.any([pd.isnull(value) for value in values], axis=0))[0]
+        codes, groups = pd.MultiIndex.from_arrays([value[grouped] for value in values]).factorize(sort=True)
+        segments = np.full(self.dataset.subjects, -1)
+        segments[grouped] = codes
+
+        def split():
+            # copies of the groups, only for the measures without additive statistics
+            order = np.argsort(segments, kind="stable")
+            bounds = np.searchsorted(segments[order], np.arange(len(groups) + 1))
+            return [self.dataset.take(order[start:end]) for start, end in zip(bounds[:-1], bounds[1:])]
+
+        measures, names = select_measures(self.dataset, measures, cost)
+        results = segmented_results(self.dataset, segments, split, measures, n_jobs, num_segments=len(groups))
+
+        index = pd.MultiIndex.from_tuples(
+            [group + (name,) for group in groups for name in names],
+            names=[getattr(key, "name", None) for key in keys] + ["measure"]
+        )
+        return pd.DataFrame({"score": np.column_stack(results).ravel()}, index=index)
+
+    def get_coder_diagnostics(self, mace=True):
+        """
+        agreement of the other coders when each coder is left out, computed at about the cost of
+        a single evaluation, with the MACE competence of each coder. Coders are ranked by the
+        Krippendorff's alpha without them, so the coders whose removal helps the most come first
+        :param mace: MaceIRR estimating the competences, True uses the default one, False skips them
+        :return: pandas.DataFrame with one row per coder
+        """
+        import pandas as pd
+
+        data = pd.DataFrame(leave_one_coder_out(self.dataset), index=pd.Index(self.dataset.coder_names, name="coder"))
 
+        if mace is not False:
+            mace = MaceIRR() if mace is True else mace
+            data["MACE competence"] = mace.fit(self.dataset).competence[:, 1]
 
+        return data.sort_values("Krippendorff's Alpha", ascending=False, kind="stable")
@@ -0,0 +1,45 @@
+"""
+Reference implementations of the MACE steps, shared by the tests and the benchmarks
+"""
+
+import numpy as np
+
+
+def loop_e_step(mace):
+    """
+    reference per-instance E-step, used to check the vectorized one
+    """
+    gold = np.zeros((mace.num_instances, mace.num_labels))
+    preference_counts = np.zeros((mace.num_annotators, mace.num_labels))
+    competence_counts = np.zeros((mace.num_annotators, 2))
+    log_marginal_likelihood = 0.0
+    labels = mace.labels
+
+    for d in range(mace.num_instances):
+        active = [a for a in range(mace.num_annotators) if labels[d][a] > -1]
+        if not active:
+            continue
+        for l in range(mace.num_labels):
+            if mace.controls and mace.controls[d] != l:
+                continue
+            gold[d][l] = 1.0 / mace.num_labels
+            for a in active:
+                annotation = labels[d][a]
+                gold[d][l] *= mace.competence[a][0] * mace.label_preference[a][annotation] + \
+                    (mace.competence[a][1] if l == annotation else 0.0)
+        marginal = gold[d].sum()
+        log_marginal_likelihood += np.log(marginal)
+
+        for a in active:
+            annotation = labels[d][a]
+            spam = mace.competence[a][0] * mace.label_preference[a][annotation]
+            strategy = sum(
+                gold[d][l] / (spam + (mace.competence[a][1] if l == annotation else 0.0))
+                for l in range(mace.num_labels)
+            ) * spam
+            preference_counts[a][annotation] += strategy / marginal
+            competence_counts[a][0] += strategy / marginal
+            competence_counts[a][1] += gold[d][annotation] * mace.competence[a][1] / \
+                (spam + mace.competence[a][1]) / marginal
+
+    return gold, preference_counts, competence_counts, log_marginal_likelihood
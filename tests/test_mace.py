@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+
+"""Tests for the MACE implementation in `quica.internal.measures`."""
+
+from quica.internal.measures import *
+from quica.measures.irr import MaceIRR
+from quica.dataset.dataset import IRRDataset
+import numpy as np
+import pandas as pd
+from tests.reference import loop_e_step
+
+
+def get_mace(dataframe, controls=None):
+    return Mace(
+        inputfile=dataframe,
+        priors={},
+        alpha=ALPHA,
+        beta=BETA,
+        em=EM,
+        controls=controls or [],
+        iterations=ITERATIONS,
+        restarts=2,
+        threshold=THRESHOLD,
+        smoothing=0,
+    )
+
+
+def test_vectorized_e_step():
+
+    np.random.seed(0)
+    labels = np.random.randint(0, 3, size=(40, 5)).astype(str)
+    labels[np.random.random(labels.shape) < 0.3] = FILLER
+    labels[7] = FILLER
+
+    for controls in [None, np.random.randint(0, 3, size=40).tolist()]:
+        mace = get_mace(pd.DataFrame(labels), controls)
+        mace.E_step()
+
+        gold, preference_counts, competence_counts, likelihood = loop_e_step(mace)
+
+        assert np.allclose(np.exp(mace.log_gold_label_marginals), gold)
+        annotated = gold.sum(axis=1) > 0
+        assert np.allclose(mace.gold_label_marginals[annotated], gold[annotated] / gold[annotated].sum(axis=1)[:, None])
+        assert np.allclose(mace.label_preference_expected_counts, preference_counts)
+        assert np.allclose(mace.competence_expected_counts, competence_counts)
+        assert np.isclose(mace.log_marginal_likelihood, likelihood)
+
+
+def test_seeded_parallel_restarts():
+
+    np.random.seed(1)
+    dataframe = pd.DataFrame(np.random.randint(0, 3, size=(30, 4)).astype(str))
+
+    results = []
+    for n_jobs, backend in [(1, "thread"), (3, "thread"), (2, "process")]:
+        mace = get_mace(dataframe)
+        mace.restarts = 5
+        mace.seed = 42
+        mace.n_jobs = n_jobs
+        mace.backend = backend
+        mace.fit()
+        results.append(mace)
+
+    for mace in results[1:]:
+        assert np.array_equal(mace.competence, results[0].competence)
+        assert mace.log_marginal_likelihood == results[0].log_marginal_likelihood
+
+    dataset = IRRDataset([[0, 1, 0, 1, 0, 1], [0, 1, 0, 1, 0, 0], [0, 1, 1, 1, 0, 0]])
+    assert MaceIRR(seed=3).compute_irr(dataset) == MaceIRR().compute_irr(dataset, n_jobs=2, seed=3)
+
+
+def test_early_stopping():
+
+    dataframe = pd.DataFrame(np.repeat(np.random.RandomState(2).randint(0, 3, size=(50, 1)), 4, axis=1).astype(str))
+
+    mace = get_mace(dataframe)
+    mace.restarts = 4
+    mace.seed = 0
+    mace.tolerance = 1e-6
+    mace.fit()
+
+    assert len(mace.restart_trace) == 4
+    assert all(trace["converged"] for trace in mace.restart_trace)
+    assert all(trace["iterations"] < MAX_ITERATIONS for trace in mace.restart_trace)
+    assert mace.log_marginal_likelihood == max(trace["log_marginal_likelihood"] for trace in mace.restart_trace)
+
+    mace = get_mace(dataframe)
+    mace.restarts = 4
+    mace.seed = 0
+    mace.prune_after = 1
+    mace.prune_margin = 0.0
+    mace.fit()
+
+    assert sum(trace["pruned"] for trace in mace.restart_trace) == 3
+    assert all(trace["iterations"] == 1 for trace in mace.restart_trace if trace["pruned"])
+    assert all(trace["iterations"] == ITERATIONS for trace in mace.restart_trace if not trace["pruned"])
+
+
+def test_sparse_annotations():
+
+    random = np.random.RandomState(3)
+    labels = random.randint(0, 3, size=(20, 6)).astype(str)
+    labels[random.random(labels.shape) < 0.5] = FILLER
+    labels[4] = FILLER
+
+    dense = get_mace(pd.DataFrame(labels))
+    dense.seed = 5
+    dense.fit()
+
+    instances, annotators = np.nonzero(labels != FILLER)
+    order = random.permutation(len(instances))
+    sparse = Mace.from_annotations(
+        instances[order], annotators[order], labels[instances, annotators][order],
+        num_instances=20, num_annotators=6,
+        priors={}, controls=[], alpha=ALPHA, beta=BETA, em=EM, iterations=ITERATIONS,
+        restarts=2, threshold=THRESHOLD, smoothing=0, seed=5,
+    )
+    sparse.fit()
+
+    assert sparse.unique_labels == dense.unique_labels == ["0", "1", "2"]
+    assert np.array_equal(sparse.labels, dense.labels)
+    assert np.allclose(sparse.competence, dense.competence)
+    assert sparse.decode() == dense.decode()
+    assert sparse.decode_distribution()[4] == ''
+
+    # memory grows with the annotations: 3 labels per item from a large pool of annotators
+    crowd = Mace.from_annotations(
+        np.repeat(np.arange(100), 3), random.randint(0, 2000, size=300), random.randint(0, 2, size=300),
+        num_annotators=2000, unique_labels=["a", "b"],
+        priors={}, controls=[], alpha=ALPHA, beta=BETA, em=EM, iterations=5,
+        restarts=1, threshold=THRESHOLD, smoothing=0,
+    )
+    crowd.fit()
+    assert crowd.competence.shape == (2000, 2)
+    assert set(crowd.decode()) <= {"a", "b"}
+
+
+def test_log_space_many_annotators():
+
+    random = np.random.RandomState(3)
+    truth = random.randint(0, 4, size=20)
+    labels = np.where(random.random_sample((20, 400)) < 0.6, truth[:, None], random.randint(0, 4, size=(20, 400)))
+
+    mace = get_mace(pd.DataFrame(labels.astype(str)))
+    mace.seed = 0
+    mace.fit()
+    assert np.isfinite(mace.log_marginal_likelihood)
+    assert np.allclose(mace.gold_label_marginals.sum(axis=1), 1.0)
+    assert [int(label) for label in mace.aggregate_labels] == truth.tolist()
+
+    single = get_mace(pd.DataFrame(labels.astype(str)))
+    single.seed = 0
+    single.dtype = np.float32
+    single.fit()
+    assert single.gold_label_marginals.dtype == np.float32
+    assert np.isclose(single.log_marginal_likelihood, mace.log_marginal_likelihood, rtol=1e-4)
+    assert np.allclose(single.competence, mace.competence, atol=1e-3)
+
+
+def test_vectorized_decode():
+
+    random = np.random.RandomState(4)
+    labels = random.randint(0, 3, size=(30, 4)).astype(str)
+    labels[5] = FILLER
+
+    mace = get_mace(pd.DataFrame(labels))
+    mace.seed = 0
+    mace.threshold = 0.5
+    mace.fit()
+
+    posteriors = mace.get_posteriors()
+    entropies = [
+        -np.sum([p * np.log(p) for p in row if p > 0]) if row.sum() > 0 else float("-inf") for row in posteriors
+    ]
+    cutoff = np.sort(entropies)[int(mace.num_instances * mace.threshold)]
+    expected = [
+        mace.int2label[int(np.argmax(row))] if entropy <= cutoff and entropy != float("-inf") else ""
+        for row, entropy in zip(posteriors, entropies)
+    ]
+
+    assert np.allclose(mace.get_label_entropies(), entropies)
+    assert mace.decode() == expected
+    assert mace.decode_distribution()[5] == ""
+    assert [label for label, _ in mace.decode_distribution()[0]][0] == mace.int2label[int(np.argmax(posteriors[0]))]
+
+    table = mace.get_decoded_table()
+    assert list(table.columns) == ["label", "entropy", "posterior_0", "posterior_1", "posterior_2"]
+    assert table["label"].astype(object).fillna("").tolist() == expected
+
+
+def test_warm_start_and_incremental_fit(tmp_path):
+
+    random = np.random.RandomState(5)
+    truth = random.randint(0, 3, size=120)
+    reliable = [0.9, 0.8, 0.3, 0.85]
+    labels = np.stack([np.where(random.random_sample(120) < p, truth, random.randint(0, 3, size=120))
+                       for p in reliable], axis=1).astype(str)
+    columns = ["ann_a", "ann_b", "ann_c", "ann_d"]
+
+    full = get_mace(pd.DataFrame(labels[:80, :3], columns=columns[:3]))
+    full.seed = 0
+    full.restarts = 10
+    full.fit()
+    full.save_state(str(tmp_path / "state.npz"))
+    state = Mace.load_state(str(tmp_path / "state.npz"))
+    assert list(state["annotators"]) == columns[:3]
+
+    # warm start on all the subjects, with a new annotator starting from the prior
+    warm = get_mace(pd.DataFrame(labels, columns=columns))
+    warm.fit(initial_state=state)
+    assert len(warm.restart_trace) == 1
+    aligned = warm.align_state(state)
+    assert np.allclose(aligned["competence"][:3], full.competence)
+    assert np.allclose(aligned["competence"][3], [ALPHA / (ALPHA + BETA), BETA / (ALPHA + BETA)])
+    assert np.argsort(warm.competence[:, 1]).tolist()[0] == 2
+
+    # incremental fit on the new subjects only keeps the counts of the first ones
+    incremental = get_mace(pd.DataFrame(labels[80:], columns=columns))
+    incremental.fit(initial_state=state, incremental=True)
+    assert np.all(incremental.competence_expected_counts[:3].sum(axis=1) >=
+                  full.competence_expected_counts.sum(axis=1))
+    assert np.isclose(incremental.competence_expected_counts[3].sum(), 40)
+    assert np.argsort(incremental.competence[:, 1]).tolist()[0] == 2
+
+    dataset = IRRDataset(pd.DataFrame(labels[80:], columns=columns))
+    assert MaceIRR(initial_state=state, incremental=True).compute_irr(dataset) == \
+        np.mean(incremental.competence[:, 1])
+
+
+def test_integer_path_matches_dataframe_path():
+
+    random = np.random.RandomState(6)
+    codes = random.randint(0, 3, size=(4, 50))
+    codes[random.random_sample(codes.shape) < 0.2] = -1
+    dataset = IRRDataset.from_codes(codes, np.arange(4))
+
+    labels = np.where(codes.T >= 0, codes.T.astype(str), FILLER)
+    mace = get_mace(pd.DataFrame(labels))
+    mace.restarts = RESTARTS
+    mace.seed = 7
+    mace.fit()
+
+    fitted = MaceIRR(seed=7).fit(dataset)
+    assert fitted.unique_labels == [0, 1, 2]
+    assert np.allclose(fitted.competence, mace.competence)
+    assert [str(label) for label in fitted.decode()] == mace.decode()
+
+    sparse = IRRDataset.from_annotations(*dataset.annotations, dataset.codebook, num_coders=4, num_subjects=50)
+    assert MaceIRR(seed=7).compute_irr(sparse) == np.mean(mace.competence[:, 1])
+
+
+def test_hook_events():
+
+    import time
+    import pytest
+
+    labels = np.random.RandomState(6).randint(0, 3, size=(15, 4)).astype(str)
+
+    def fit(events=None, **parameters):
+        events = [] if events is None else events
+        mace = Mace(
+            inputfile=pd.DataFrame(labels), priors={}, controls=None, alpha=ALPHA, beta=BETA, em=EM,
+            iterations=5, restarts=3, threshold=THRESHOLD, smoothing=0, seed=1,
+            hook=lambda event, data: events.append((event, data)), **parameters
+        )
+        mace.fit()
+        return mace, events
+
+    for parameters in [{}, {"n_jobs": 2}, {"n_jobs": 2, "backend": "process"},
+                       {"tolerance": 1e-12, "max_iterations": 8, "prune_after": 2, "prune_margin": 0.0}]:
+        mace, events = fit(**parameters)
+        names = [event for event, _ in events]
+        assert events[0] == ("mace_fit", dict(events[0][1], controls=False))
+        assert names[-1] == "mace_done"
+        restarts = [data for event, data in events if event == "mace_restart"]
+        assert sorted(restarts, key=lambda restart: restart["restart"]) == mace.restart_trace
+        assert names.count("mace_iteration") == sum(trace["iterations"] + 1 for trace in mace.restart_trace)
+
+    # in this process, iterations are reported as they run, before a deadline stops the fit
+    events = []
+    with pytest.raises(TimeoutError):
+        fit(events, deadline=time.time())
+    assert [event for event, _ in events] == ["mace_fit", "mace_iteration", "mace_iteration"]
+
+    _, events = fit()
+    names = [event for event, _ in events]
+    assert names[1:4] == ["mace_iteration"] * 3 and names[6:8] == ["mace_iteration", "mace_restart"]
@@ -5,7 +5,9 @@
 from quica.measures.irr import *
 from quica.dataset.dataset import IRRDataset
 from quica.quica import Quica
+import numpy as np
 import pandas as pd
+import pytest
 
 
 def test_complete_agreement():
@@ -58,3 +60,545 @@ def test_quica_complete():
     (quica.get_results())
 
 
+
+
+def test_cached_statistics():
+
+    coder_1 = ["a", "b", "a", None, "c"]
+    coder_2 = ["a", "b", "b", "c", "c"]
+    coder_3 = ["a", "a", "b", "c", float("nan")]
+
+    dataset = IRRDataset([coder_1, coder_2, coder_3])
+
+    assert list(dataset.codebook) == ["a", "b", "c"]
+    assert dataset.codes.tolist() == [[0, 1, 0, -1, 2], [0, 1, 1, 2, 2], [0, 0, 1, 2, -1]]
+    assert dataset.item_counts.tolist() == [[3, 0, 0], [1, 2, 0], [1, 2, 0], [0, 0, 2], [0, 0, 2]]
+    assert dataset.coder_counts.sum() == 13
+    assert dataset.item_counts is dataset.item_counts
+    assert dataset.coincidence is dataset.coincidence
+
+    import krippendorff
+    numeric = [[1, 2, 1, np.nan, 3], [1, 2, 2, 3, 3], [1, 1, 2, 3, np.nan]]
+    assert np.isclose(Krippendorff().compute_irr(dataset),
+                      krippendorff.alpha(numeric, level_of_measurement="nominal"))
+
+
+def test_fleiss_scotts_match_nltk():
+
+    from nltk.metrics.agreement import AnnotationTask
+
+    random = np.random.RandomState(0)
+    for coders, subjects, categories in [(2, 10, 2), (3, 25, 3), (5, 40, 4)]:
+        data = random.randint(0, categories, size=(coders, subjects))
+        task = AnnotationTask(data=[(c, s, data[c][s]) for c in range(coders) for s in range(subjects)])
+        dataset = IRRDataset(data.tolist())
+
+        assert np.isclose(FleissK().compute_irr(dataset), task.multi_kappa())
+        assert np.isclose(ScottsPI().compute_irr(dataset), task.pi())
+
+
+def test_fleiss_scotts_missing_annotations():
+
+    dataset = IRRDataset([[0, 1, 2, 0, 1, None], [0, 1, 2, 0, None, 2], [0, 1, None, 0, 1, 2]])
+    assert np.isclose(FleissK().compute_irr(dataset), 1)
+    assert np.isclose(ScottsPI().compute_irr(dataset), 1)
+
+    random = np.random.RandomState(2)
+    data = random.randint(0, 3, size=(6, 40))
+    data[random.random_sample(data.shape) < 0.4] = -1
+    dataset = IRRDataset.from_codes(data, np.arange(3))
+
+    # per-subject agreement over the coders of the subject, averaged over the subjects with two annotations
+    agreements = []
+    for labels in data.T:
+        labels = labels[labels >= 0]
+        if len(labels) > 1:
+            agreements.append(np.mean([a == b for i, a in enumerate(labels) for j, b in enumerate(labels) if i != j]))
+    observed = np.mean(agreements)
+
+    pooled = np.bincount(data[data >= 0], minlength=3) / (data >= 0).sum()
+    expected = (pooled ** 2).sum()
+    assert np.isclose(ScottsPI().compute_irr(dataset), (observed - expected) / (1 - expected))
+
+    proportions = [np.bincount(row[row >= 0], minlength=3) / (row >= 0).sum() for row in data]
+    expected = np.mean([np.dot(proportions[i], proportions[j]) for i in range(6) for j in range(6) if i != j])
+    assert np.isclose(FleissK().compute_irr(dataset), (observed - expected) / (1 - expected))
+
+
+def test_raw_agreement_counts():
+
+    from itertools import combinations
+    from sklearn.metrics import accuracy_score
+
+    data = np.random.RandomState(1).randint(0, 3, size=(6, 30))
+    dataset = IRRDataset(data.tolist())
+
+    assert np.isclose(RawAgreement().compute_irr(dataset),
+                      np.mean([accuracy_score(a, b) for a, b in combinations(data, 2)]))
+
+    matrix = RawAgreement().pairwise(dataset)
+    assert matrix.shape == (6, 6)
+    assert np.allclose(np.diag(matrix), 1)
+    assert np.isclose(matrix.iloc[1, 4], accuracy_score(data[1], data[4]))
+
+    # missing annotations are skipped, pairs of coders are scored on the subjects both annotated
+    data[np.random.RandomState(2).random_sample(data.shape) < 0.3] = -1
+    dataset = IRRDataset.from_codes(data, np.arange(3))
+    matrix = RawAgreement().pairwise(dataset)
+    assert np.allclose(np.diag(matrix), 1)
+    both = (data[1] >= 0) & (data[4] >= 0)
+    assert np.isclose(matrix.iloc[1, 4], accuracy_score(data[1][both], data[4][both]))
+
+    assert np.isclose(RawAgreement().compute_irr(IRRDataset([[0, 1, 2, 0, 1, None], [0, 1, 2, 0, None, 2],
+                                                             [0, 1, None, 0, 1, 2]])), 1)
+
+
+def test_compact_dataset():
+
+    codes = np.array([[0, 1, 2, 1], [0, 1, 1, 2]], dtype=np.int8)
+    dataset = IRRDataset(codes)
+    assert dataset.codes is codes
+    assert list(dataset.codebook) == [0, 1, 2]
+
+    dataset = IRRDataset([["x", "y"], ["y", "y", "x"]])
+    assert dataset.codes.dtype == np.int8
+    assert dataset.codes.tolist() == [[0, 1, -1], [1, 1, 0]]
+    assert list(dataset.get_coder(0)) == ["x", "y", None]
+    assert (dataset.coders, dataset.subjects) == (2, 3)
+
+    dataset = IRRDataset([list(range(300)), list(range(300))])
+    assert dataset.codes.dtype == np.int16
+
+    # large integer labels are factorized, not used as indices
+    dataset = IRRDataset([[0, 10 ** 13], [0, 10 ** 13]])
+    assert dataset.codes.tolist() == [[0, 1], [0, 1]]
+    assert list(dataset.codebook) == [0, 10 ** 13]
+
+    dataframe = pd.DataFrame({"first": [1, 2, 1], "second": [1, 2, 2]})
+    dataset = IRRDataset(dataframe)
+    assert dataset.coder_names == ["first", "second"]
+    assert dataset.codes.tolist() == [[0, 1, 0], [0, 1, 1]]
+    assert list(RawAgreement().pairwise(dataset).columns) == ["first", "second"]
+
+    assert not hasattr(dataset, "__dict__")
+
+
+def test_accumulator_matches_full_recomputation():
+
+    from quica.measures.accumulator import AgreementAccumulator
+
+    random = np.random.RandomState(4)
+    data = random.choice(["a", "b", "c", "d"], size=(4, 60)).astype(object)
+    data[random.random_sample(data.shape) < 0.1] = None
+    data[:, :20][data[:, :20] == "d"] = "c"
+
+    accumulator = AgreementAccumulator()
+    for start in range(0, 60, 20):
+        accumulator.update(data[:, start:start + 20])
+
+    dataset = IRRDataset(data)
+    assert np.isclose(accumulator.krippendorff(), Krippendorff().compute_irr(dataset))
+    assert np.isclose(accumulator.fleiss(), FleissK().compute_irr(dataset))
+    assert np.isclose(accumulator.scotts(), ScottsPI().compute_irr(dataset))
+    assert np.isclose(accumulator.raw(), RawAgreement().compute_irr(dataset))
+    assert accumulator.get_results().shape == (4, 1)
+
+
+def test_bootstrap_matches_resampled_datasets():
+
+    from quica.measures.bootstrap import Bootstrap, weighted_sums
+
+    random = np.random.RandomState(5)
+    data = random.randint(0, 3, size=(3, 40)).astype(object)
+    data[random.random_sample(data.shape) < 0.1] = None
+    dataset = IRRDataset(data)
+
+    bootstrap = Bootstrap(replicates=5, seed=0)
+    weights = next(bootstrap.get_weights(dataset.subjects))
+
+    for measure in [Krippendorff(), ScottsPI(), RawAgreement(), FleissK()]:
+        quantities, score = measure.get_statistic(dataset)
+        scores = score(weighted_sums(weights, quantities))
+        for row, value in zip(weights, scores):
+            resampled = dataset.take(np.repeat(np.arange(dataset.subjects), row))
+            assert np.isclose(value, measure.compute_irr(resampled))
+
+    two_coders = IRRDataset.from_codes(dataset.codes[:2], dataset.codebook)
+    quantities, score = CohensK().get_statistic(two_coders)
+    assert np.isclose(score(weighted_sums(weights, quantities))[0],
+                      CohensK().compute_irr(two_coders.take(np.repeat(np.arange(40), weights[0]))))
+
+
+def test_bootstrap_resamples_lazily(monkeypatch):
+
+    from quica.measures.bootstrap import Bootstrap
+
+    dataset = IRRDataset(np.random.RandomState(5).randint(0, 3, size=(3, 40)))
+    sizes = []
+
+    class Resampled(IRRMeasure):
+        def compute_irr(self, resampled):
+            sizes.append(resampled.subjects)
+            return float(len(sizes))
+
+    taken = []
+    take = IRRDataset.take
+    monkeypatch.setattr(IRRDataset, "take", lambda self, subjects: taken.append(1) or take(self, subjects))
+
+    def score(job):
+        # at most two resampled datasets per worker are built ahead of their fit
+        assert len(taken) - len(sizes) <= 2
+        measure, resampled = job
+        return measure.compute_irr(resampled)
+
+    monkeypatch.setattr("quica.measures.bootstrap._resampled_score", score)
+    replicates = Bootstrap(replicates=7, seed=0).get_replicates(dataset, [Resampled(), Krippendorff()])
+    assert np.array_equal(replicates[0], np.arange(1, 8)) and len(replicates[1]) == 7
+    assert sizes == [40] * 7
+
+
+def test_quica_bootstrap():
+
+    from quica.measures.bootstrap import Bootstrap
+
+    random = np.random.RandomState(6)
+    truth = random.randint(0, 3, size=30)
+    coders = [np.where(random.random_sample(30) < 0.8, truth, random.randint(0, 3, size=30)) for _ in range(3)]
+    quica = Quica(IRRDataset(coders))
+
+    for method in ["percentile", "bca"]:
+        results = quica.get_results(bootstrap=Bootstrap(replicates=4, method=method, seed=1))
+        assert list(results.columns) == ["score", "ci_lower", "ci_upper"]
+        assert (results["ci_lower"] <= results["ci_upper"]).all()
+
+
+def test_read_long(tmp_path):
+
+    from quica.dataset.loaders import read_long
+
+    random = np.random.RandomState(7)
+    wide = random.choice(["neg", "neu", "pos"], size=(25, 4)).astype(object)
+    wide[random.random_sample(wide.shape) < 0.2] = None
+
+    rows = [(item, "coder{}".format(coder), wide[item, coder])
+            for item in range(25) for coder in range(4) if wide[item, coder] is not None]
+    rows = [rows[index] for index in random.permutation(len(rows))]
+    path = tmp_path / "annotations.csv"
+    pd.DataFrame(rows, columns=["item_id", "coder_id", "label"]).to_csv(path, index=False)
+
+    dataset = read_long(path, chunksize=7)
+    expected = IRRDataset(wide.T)
+
+    assert dataset.is_sparse
+    assert list(dataset.codebook) == ["neg", "neu", "pos"]
+    assert (dataset.coders, dataset.subjects) == (4, 25)
+
+    # align coders and items with the wide table
+    coder_order = [dataset.coder_names.index("coder{}".format(coder)) for coder in range(4)]
+    item_order = [list(dataset.subject_names).index(str(item)) for item in range(25)]
+    assert np.array_equal(dataset.codes[coder_order][:, item_order], expected.codes)
+
+    for measure in [Krippendorff(), FleissK(), ScottsPI(), RawAgreement()]:
+        assert np.isclose(measure.compute_irr(dataset), measure.compute_irr(expected))
+
+    resampled = dataset.take([3, 3, 0])
+    assert np.array_equal(resampled.codes, dataset.codes[:, [3, 3, 0]])
+
+    # a string after numeric labels in the first chunks must not split the codes of the numbers
+    labels = ["0", "1", "1", "0", "1", "0", "0", "1", "x", "1"]
+    mixed = tmp_path / "mixed.csv"
+    pd.DataFrame({"item_id": np.arange(10) // 2, "coder_id": np.arange(10) % 2, "label": labels}).to_csv(mixed,
+                                                                                                       index=False)
+    datasets = [read_long(mixed, chunksize=chunksize) for chunksize in [4, 100]]
+    assert [list(dataset.codebook) for dataset in datasets] == [["0", "1", "x"]] * 2
+    assert np.array_equal(datasets[0].codes, datasets[1].codes)
+
+    # repeated (item, coder) rows keep the last label, across chunks
+    repeated = tmp_path / "repeated.csv"
+    pd.DataFrame({"item_id": [0, 0, 1, 1, 0, 2, 2], "coder_id": ["a", "b", "a", "b", "a", "a", "b"],
+                  "label": ["x", "y", "y", "y", "y", "z", "z"]}).to_csv(repeated, index=False)
+    for chunksize in [3, 100]:
+        dataset = read_long(repeated, chunksize=chunksize)
+        assert list(dataset.codebook) == ["y", "z"]
+        assert dataset.codes.tolist() == [[0, 0, 1], [0, 0, 1]]
+        assert Krippendorff().compute_irr(dataset) == 1
+
+
+def test_batch_results_match_single_tasks():
+
+    random = np.random.RandomState(8)
+    truth = random.randint(0, 4, size=40)
+    tasks = {}
+    for task, categories in zip(["topic", "sentiment", "sarcasm"], [4, 3, 2]):
+        coders = [np.where(random.random_sample(40) < 0.7, truth % categories, random.randint(0, categories, size=40))
+                  for _ in range(3)]
+        tasks[task] = pd.DataFrame({"coder_{}".format(index): labels for index, labels in enumerate(coders)})
+    tasks["sentiment"].iloc[:5, 1] = None
+
+    results = Quica.get_batch_results(tasks)
+    assert list(results.index) == ["topic", "sentiment", "sarcasm"]
+    assert results["MACE"].between(0, 1).all()
+
+    stacked = Quica.get_batch_results(pd.concat(tasks, axis=1))
+    for task, dataframe in tasks.items():
+        single = Quica(dataframe=dataframe).get_results()["score"].drop("MACE")
+        assert np.allclose(results.loc[task, single.index].astype(float), single)
+        assert np.allclose(stacked.loc[task, single.index].astype(float), single)
+
+    # interval and ratio alpha use the label values of each task, not the codes of the stacked dataset
+    scales = {"topic": [1, 2, 5, 40], "sentiment": [2, 10, 30], "sarcasm": [0, 7]}
+    rated = {task: dataframe.apply(lambda labels: labels.map(dict(enumerate(scales[task]))))
+             for task, dataframe in tasks.items()}
+    rated["sentiment"] = rated["sentiment"].astype(str).replace("nan", None)
+    measures = [Krippendorff(level) for level in ["ordinal", "interval", "ratio"]]
+    results = Quica.get_batch_results(rated, measures=measures)
+    for task, dataframe in rated.items():
+        single = Quica(dataframe=dataframe).get_results(measures=measures)["score"]
+        assert np.allclose(results.loc[task, single.index].astype(float), single)
+
+
+def test_group_results_match_split_datasets():
+
+    random = np.random.RandomState(9)
+    truth = random.randint(0, 3, size=60)
+    coders = [np.where(random.random_sample(60) < 0.75, truth, random.randint(0, 3, size=60)) for _ in range(3)]
+    dataset = IRRDataset(coders)
+    source = pd.Series(np.array(["web", "mail", "chat"] * 20, dtype=object), name="source")
+    source[:3] = None
+    batch = np.arange(60) // 30
+
+    results = Quica(dataset).get_group_results([source, batch])
+    assert results.index.names == ["source", None, "measure"]
+    assert set(results.index.droplevel(-1)) == {(group, index) for group in ["web", "mail", "chat"] for index in [0, 1]}
+
+    for (group, index), subset in results.groupby(level=[0, 1]):
+        subjects = np.nonzero((source == group).values & (batch == index))[0]
+        single = Quica(IRRDataset([labels[subjects] for labels in coders])).get_results()["score"].drop("MACE")
+        assert np.allclose(subset.droplevel([0, 1])["score"][single.index], single)
+
+
+def test_group_results_unannotated_group():
+
+    quica = Quica(IRRDataset([[0, 1, None], [0, 1, None]]))
+    results = quica.get_group_results([0, 0, 1], measures=["krippendorff", MaceIRR(seed=0)])
+    assert results["score"].loc[0].notna().all()
+    assert results["score"].loc[1].isna().all()
+
+
+def test_group_results_without_copies(monkeypatch):
+
+    dataset = IRRDataset([[0, 1, 1, 0, 1, 2], [0, 1, 0, 0, 1, 2], [0, 1, 1, 1, 1, 2]])
+
+    def take(self, subjects):
+        raise AssertionError("additive measures do not copy the groups")
+
+    monkeypatch.setattr(IRRDataset, "take", take)
+    results = Quica(dataset).get_group_results([0, 0, 0, 1, 1, 1], cost="fast")
+    assert results["score"].notna().all()
+
+
+def test_selected_measures():
+
+    from quica.measures.registry import select_measures
+
+    dataset = IRRDataset([[0, 1, 1, 0, 1], [0, 1, 0, 0, 1], [0, 1, 1, 1, 1]])
+    quica = Quica(dataset)
+
+    _, names = select_measures(dataset)
+    assert names == ["Krippendorff's Alpha", "Scotts' Kappa", "Raw Agreement", "MACE", "Fleiss'K"]
+    _, names = select_measures(IRRDataset([[0, 1], [1, 1]]), cost="fast")
+    assert names == ["Krippendorff's Alpha", "Scotts' Kappa", "Raw Agreement", "Cohen's K"]
+
+    class Disagreement(IRRMeasure):
+        def compute_irr(self, dataset):
+            return 1 - RawAgreement().compute_irr(dataset)
+
+    results = quica.get_results(measures=["raw", "fleiss", Disagreement()])
+    assert list(results.index) == ["Raw Agreement", "Fleiss'K", "Disagreement"]
+    assert np.isclose(results.loc["Disagreement", "score"], 1 - results.loc["Raw Agreement", "score"])
+
+    results = quica.get_results(measures=["krippendorff", "mace"], time_budget=0)
+    assert np.isfinite(results.loc["Krippendorff's Alpha", "score"])
+    assert np.isnan(results.loc["MACE", "score"])
+
+
+def test_result_cache(tmp_path, monkeypatch):
+
+    from quica.internal.cache import ResultCache
+
+    codes = [[0, 1, 1, 0, 1, 2], [0, 1, 0, 0, 1, 2], [0, 1, 1, 1, 1, 2]]
+    measures = ["krippendorff", MaceIRR(seed=3)]
+
+    quica = Quica(IRRDataset(codes), cache=str(tmp_path))
+    results = quica.get_results(measures=measures)
+    assert len(list(tmp_path.iterdir())) == 2
+
+    def refit(self, dataset, **kwargs):
+        raise AssertionError("cached results are not computed again")
+
+    # the instance memoizes the results and a new report on an equal dataset reads them from disk
+    monkeypatch.setattr(MaceIRR, "compute_irr", refit)
+    assert quica.get_results(measures=measures).equals(results)
+    assert Quica(IRRDataset(codes), cache=str(tmp_path)).get_results(measures=measures).equals(results)
+
+    # the key includes the parameters of the measure, but not how it is run, and the cache may be a path
+    with pytest.raises(AssertionError):
+        Quica(IRRDataset(codes), cache=str(tmp_path)).get_results(measures=[MaceIRR(seed=4)])
+    assert Quica(IRRDataset(codes), cache=tmp_path).get_results(
+        measures=["krippendorff", MaceIRR(seed=3, n_jobs=2)]).equals(results)
+
+    # MACE without a seed is not reproducible, so it is only memoized on the instance
+    monkeypatch.undo()
+    unseeded = Quica(IRRDataset(codes), cache=str(tmp_path))
+    unseeded.get_results(measures=[MaceIRR()])
+    assert len(list(tmp_path.iterdir())) == 2
+    assert unseeded.get_results(measures=[MaceIRR()]).equals(unseeded.get_results(measures=[MaceIRR()]))
+
+    cache = ResultCache(str(tmp_path), max_entries=2)
+    cache.set(1.0, "key")
+    assert len(list(tmp_path.iterdir())) == 2
+    assert cache.get("key") == 1.0
+
+    # results of another version of quica are not served
+    monkeypatch.setattr("quica.internal.cache.__version__", "0.0.0")
+    assert cache.get("key") is None
+
+
+def test_profile_and_hook():
+
+    events = []
+
+    def hook(event, data):
+        events.append((event, data))
+
+    quica = Quica(IRRDataset([[0, 1, 1, 0, 1, 2], [0, 1, 0, 0, 1, 2], [0, 1, 1, 1, 1, 2]]))
+    results = quica.get_results(measures=["raw", MaceIRR(seed=0, hook=hook)], profile=True, hook=hook)
+
+    assert list(results.columns) == ["score", "wall_time", "cpu_time", "peak_memory"]
+    assert (results[["wall_time", "cpu_time", "peak_memory"]] >= 0).all().all()
+
+    names = [event for event, _ in events]
+    assert names[0] == "measure" and names[1] == "mace_fit" and names[-2:] == ["mace_done", "measure"]
+    assert names.count("mace_restart") == 10
+    restarts = [data for event, data in events if event == "mace_restart"]
+    iterations = [data for event, data in events if event == "mace_iteration"]
+    assert len(iterations) == sum(restart["iterations"] + 1 for restart in restarts)
+    assert events[-1][1]["measure"] == "MACE" and events[-1][1]["score"] == results.loc["MACE", "score"]
+
+    # the hook is dropped when the measure is sent to worker processes
+    measure = MaceIRR(seed=0, hook=lambda event, data: events.append(event))
+    groups = quica.get_group_results([0, 0, 0, 1, 1, 1], n_jobs=2, measures=[measure])
+    assert groups["score"].notna().all()
+    assert measure.hook is not None
+
+
+def test_lazy_imports():
+
+    import subprocess
+    import sys
+
+    script = "import sys, quica.quica; print([name for name in ['pandas', 'scipy', 'sklearn'] if name in sys.modules])"
+    output = subprocess.run([sys.executable, "-c", script], check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    assert output.strip() == "[]"
+
+
+def test_pairwise_cohens_kappa():
+
+    from sklearn.metrics import cohen_kappa_score
+
+    random = np.random.RandomState(10)
+    truth = random.randint(0, 4, size=80)
+    codes = np.stack([np.where(random.random_sample(80) < 0.7, truth, random.randint(0, 4, size=80))
+                      for _ in range(5)])
+    codes[random.random_sample(codes.shape) < 0.2] = -1
+    dataset = IRRDataset.from_codes(codes, np.arange(4), coder_names=list("abcde"))
+
+    kappas = CohensK().pairwise(dataset)
+    assert list(kappas.index) == list("abcde")
+
+    for first in range(5):
+        for second in range(5):
+            both = (codes[first] >= 0) & (codes[second] >= 0)
+            expected = cohen_kappa_score(codes[first][both], codes[second][both])
+            assert np.isclose(kappas.iloc[first, second], expected)
+
+    assert np.isclose(kappas.iloc[0, 1], CohensK().compute_irr(IRRDataset.from_codes(codes[:2], np.arange(4))))
+
+
+def test_levels_of_measurement():
+
+    import krippendorff
+    from sklearn.metrics import cohen_kappa_score
+
+    random = np.random.RandomState(11)
+    truth = random.randint(1, 8, size=60)
+    ratings = np.stack([np.clip(truth + random.randint(-2, 3, size=60), 1, 7) for _ in range(4)])
+    ratings[random.random_sample(ratings.shape) < 0.2] = -1
+    dataset = IRRDataset.from_codes(np.where(ratings > 0, ratings - 1, -1), np.arange(1, 8))
+    numeric = np.where(ratings > 0, ratings, np.nan)
+
+    for level in ["nominal", "ordinal", "interval", "ratio"]:
+        measure = Krippendorff(level)
+        expected = krippendorff.alpha(numeric, level_of_measurement=level)
+        assert np.isclose(measure.compute_irr(dataset), expected)
+
+        quantities, score = measure.get_statistic(dataset)
+        assert np.isclose(score(np.asarray(quantities.sum(axis=0)).ravel()), expected)
+
+    pair = IRRDataset.from_codes(np.stack([truth, np.clip(truth + random.randint(-1, 2, size=60), 1, 7)]) - 1,
+                                 np.arange(1, 8))
+    for weights in [None, "linear", "quadratic"]:
+        expected = cohen_kappa_score(truth, np.asarray(pair.codebook)[pair.codes[1]], weights=weights,
+                                     labels=np.arange(1, 8))
+        assert np.isclose(CohensK(weights).compute_irr(pair), expected)
+
+    results = Quica(dataset).get_results(measures=["krippendorff", Krippendorff("ordinal")])
+    assert list(results.index) == ["Krippendorff's Alpha", "Krippendorff's Alpha (ordinal)"]
+
+    with pytest.raises(Exception):
+        Krippendorff("interval").compute_irr(IRRDataset([["a", "b"], ["a", "a"]]))
+
+    # a 1-10 scale read as strings is ranked by value, not lexicographically
+    scale = np.clip(np.stack([truth, truth + 3, truth - 1]) + random.randint(-1, 2, size=(3, 60)), 1, 10)
+    strings = IRRDataset(scale.astype(str))
+    assert list(strings.codebook[:3]) == ["1", "10", "2"]
+    assert np.isclose(Krippendorff("ordinal").compute_irr(strings),
+                      krippendorff.alpha(scale.astype(float), level_of_measurement="ordinal"))
+    quantities, score = Krippendorff("ordinal").get_statistic(strings)
+    assert np.isclose(score(np.asarray(quantities.sum(axis=0)).ravel()), Krippendorff("ordinal").compute_irr(strings))
+
+    pair = IRRDataset(scale[:2].astype(str))
+    for weights in ["linear", "quadratic"]:
+        expected = cohen_kappa_score(scale[0], scale[1], weights=weights, labels=np.arange(1, 11))
+        assert np.isclose(CohensK(weights).compute_irr(pair), expected)
+
+    # an explicit order ranks labels that are not numbers
+    words = np.array(["low", "mid", "high"], dtype=object)[np.clip(scale // 4, 0, 2)]
+    order = ["low", "mid", "high"]
+    assert np.isclose(Krippendorff("ordinal", order=order).compute_irr(IRRDataset(words)),
+                      krippendorff.alpha(np.clip(scale // 4, 0, 2).astype(float), level_of_measurement="ordinal"))
+    assert np.isclose(CohensK("linear", order=order).compute_irr(IRRDataset(words[:2])),
+                      cohen_kappa_score(words[0], words[1], weights="linear", labels=order))
+
+
+def test_leave_one_coder_out():
+
+    random = np.random.RandomState(11)
+    truth = random.randint(0, 3, size=60)
+    codes = np.stack([np.where(random.random_sample(60) < p, truth, random.randint(0, 3, size=60))
+                      for p in [0.9, 0.85, 0.8, 0.2, 0.75]])
+    codes[random.random_sample(codes.shape) < 0.25] = -1
+    codes[:4, 0] = -1
+    dataset = IRRDataset.from_codes(codes, np.arange(3), coder_names=list("abcde"))
+
+    diagnostics = Quica(dataset).get_coder_diagnostics(mace=MaceIRR(seed=0))
+    assert diagnostics.index[0] == "d"
+    assert list(diagnostics.columns) == ["Krippendorff's Alpha", "Fleiss'K", "Scotts' Kappa", "Raw Agreement",
+                                         "MACE competence"]
+    assert diagnostics["MACE competence"].idxmin() == "d"
+
+    for coder, name in enumerate("abcde"):
+        others = IRRDataset.from_codes(np.delete(codes, coder, axis=0), np.arange(3))
+        expected = Quica(others).get_results(measures=["krippendorff", "fleiss", "scotts", "raw"])["score"]
+        assert np.allclose(diagnostics.loc[name, expected.index], expected)